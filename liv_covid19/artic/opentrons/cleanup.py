@@ -53,6 +53,11 @@ _VOLS = {
 # Scale volumes:
 _VOL_SCALE = 1.0
 
+# Run parameters, overriding the defaults above (in parameter block mode):
+_PARAMS = {}
+
+globals().update(_PARAMS)
+
 _VOLS = {key: vol * _VOL_SCALE if key in ['beads', 'pool'] else vol
          for key, vol in _VOLS.items()}
 
@@ -29,6 +29,11 @@ _VOLS = {
     'RNA': 30.0
 }
 
+# Run parameters, overriding the defaults above (in parameter block mode):
+_PARAMS = {}
+
+globals().update(_PARAMS)
+
 
 def run(protocol):
     '''Run protocol.'''
@@ -0,0 +1,154 @@
+'''
+(c) University of Liverpool 2020
+
+Licensed under the MIT License.
+
+To view a copy of this license, visit <http://opensource.org/licenses/MIT/>..
+
+@author: neilswainston
+'''
+# pylint: disable=attribute-defined-outside-init
+# pylint: disable=invalid-name
+import io
+import json
+import tempfile
+from threading import Event, Thread
+import time
+import unittest
+
+from liv_covid19.web import manager
+from liv_covid19.web.job import END_STATUSES, JobThread, ResultBundle
+
+
+class _PlateThread(JobThread):
+    '''Runs a trivial plate job, once its gate (if any) is open.'''
+
+    def __init__(self, query, content, gate=None):
+        JobThread.__init__(self, query, 1)
+        self.__content = content
+        self.__gate = gate
+
+    def get_app(self):
+        '''Gets app of job.'''
+        return 'Normalise'
+
+    def run(self):
+        '''Run.'''
+        self._fire_job_event('running', 0, 'Running...')
+
+        if self.__gate:
+            self.__gate.wait()
+
+        bundle = ResultBundle()
+        bundle.add('plate.csv', self.__content.read())
+        self.__content.close()
+        self._bundle = bundle
+        self._result = self._job_id
+        self._fire_job_event('finished', 1, message='Job completed')
+
+
+class TestBatch(unittest.TestCase):
+    '''Test class for batch submission.'''
+
+    def test_feed_full_queue(self):
+        '''Tests feeding a plate while another batch is fed, as the queue is
+        found full.'''
+        gate = Event()
+        batch_ids = []
+
+        def _get_thread(query, content):
+            '''Gets plate thread, feeding a second batch as the first batch's
+            plate is submitted.'''
+            if query.get('file_name') == 'first.csv' and not batch_ids:
+                batch_ids.append(mngr.submit_batch(
+                    {}, [('second.csv', io.BytesIO(b'2'))]))
+
+            return _PlateThread(query, content, gate)
+
+        mngr = manager.Manager(tempfile.mkdtemp(), max_workers=1,
+                               max_queue=1, result_mode='memory',
+                               cache_size=0, get_thread=_get_thread)
+
+        # Fill the only worker, and the queue:
+        running_id = mngr.submit_file({}, io.BytesIO(b'running'))
+        _wait(mngr, [running_id], ['running'])
+        mngr.submit_file({}, io.BytesIO(b'queued'))
+
+        batch_ids.insert(0, mngr.submit_batch(
+            {}, [('first.csv', io.BytesIO(b'1'))]))
+        gate.set()
+
+        _wait(mngr, batch_ids, END_STATUSES)
+        self.assertEqual([mngr.get_status(job_id) for job_id in batch_ids],
+                         ['finished'] * 2)
+
+    def test_feed_concurrent(self):
+        '''Tests feeding of concurrent batches into a small job queue.'''
+        # Stress test of plates being fed by several threads at once, which
+        # once lost plates to a race (now fixed) between them:
+        for _ in range(5):
+            self.__feed_concurrent()
+
+    def __feed_concurrent(self):
+        '''Tests feeding of 5 concurrent batches of 30 plates.'''
+        mngr = manager.Manager(tempfile.mkdtemp(), max_workers=2,
+                               max_queue=2, result_mode='memory',
+                               cache_size=0, get_thread=_PlateThread)
+        job_ids = [None] * 5
+
+        def _submit(idx):
+            '''Submits batch of 30 plates.'''
+            files = [('plate_%i_%i.csv' % (idx, plate),
+                      io.BytesIO(b'%i,%i' % (idx, plate)))
+                     for plate in range(30)]
+            job_ids[idx] = mngr.submit_batch({}, files)
+
+        threads = [Thread(target=_submit, args=(idx,)) for idx in range(5)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        _wait(mngr, job_ids, END_STATUSES)
+
+        for idx, job_id in enumerate(job_ids):
+            self.assertEqual(mngr.get_status(job_id), 'finished')
+            self.__assert_bundle(mngr.get_bundle(job_id), idx)
+
+    def __assert_bundle(self, bundle, idx):
+        '''Asserts bundle of batch holds its plates' results, in submission
+        order, and their statuses.'''
+        names = ['plate_%i_%i' % (idx, plate) for plate in range(30)]
+        files = bundle.get_files()
+
+        self.assertEqual([name for name, _ in files],
+                         [name + '/plate.csv' for name in names] +
+                         ['batch.json'])
+
+        self.assertEqual([data for _, data in files[:-1]],
+                         [b'%i,%i' % (idx, plate) for plate in range(30)])
+
+        plates = json.loads(files[-1][1])
+        self.assertEqual(list(plates), names)
+
+        for name, plate in plates.items():
+            self.assertEqual(plate['file_name'], name + '.csv')
+            self.assertEqual(plate['status'], 'finished')
+            self.assertEqual(plate['message'], 'Job completed')
+            self.assertTrue(plate['job_id'])
+
+
+def _wait(mngr, job_ids, statuses, timeout=10):
+    '''Waits, for up to timeout, for jobs to reach one of statuses.'''
+    end = time.time() + timeout
+
+    while time.time() < end and \
+            any(mngr.get_status(job_id) not in statuses
+                for job_id in job_ids):
+        time.sleep(0.01)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+'''
+(c) University of Liverpool 2020
+
+Licensed under the MIT License.
+
+To view a copy of this license, visit <http://opensource.org/licenses/MIT/>..
+
+@author: neilswainston
+'''
+# pylint: disable=invalid-name
+import unittest
+
+from liv_covid19.web import cache
+
+
+class TestCache(unittest.TestCase):
+    '''Test class for the result cache.'''
+
+    def test_get_key(self):
+        '''Tests normalisation of queries in cache keys.'''
+        key = cache.get_key({'app': 'Normalise', 'target_mass': 50,
+                             'vol_scale': 1, 'temp_deck': 'tempdeck'},
+                            'digest')
+
+        # Numeric parameters as strings, parameter order and file name are
+        # ignored:
+        self.assertEqual(cache.get_key({'temp_deck': 'tempdeck',
+                                        'vol_scale': '1.0',
+                                        'target_mass': '50',
+                                        'app': 'Normalise',
+                                        'file_name': 'plate.csv'},
+                                       'digest'),
+                         key)
+
+        # Parameters and file content are not:
+        self.assertNotEqual(cache.get_key({'app': 'Normalise',
+                                           'target_mass': 50,
+                                           'vol_scale': 1,
+                                           'temp_deck': 'tempdeck',
+                                           'params_mode': 'block'},
+                                          'digest'),
+                            key)
+        self.assertNotEqual(cache.get_key({'app': 'Opentrons',
+                                           'target_mass': 50,
+                                           'vol_scale': 1,
+                                           'temp_deck': 'tempdeck'},
+                                          'digest'),
+                            key)
+        self.assertNotEqual(cache.get_key({'app': 'Normalise',
+                                           'target_mass': 50,
+                                           'vol_scale': 1,
+                                           'temp_deck': 'tempdeck'},
+                                          'other'),
+                            key)
+
+    def test_result_cache(self):
+        '''Tests least recently used eviction, and statistics.'''
+        result_cache = cache.ResultCache(2)
+        result_cache.put('a', 'job_a')
+        result_cache.put('b', 'job_b')
+
+        self.assertEqual(result_cache.get('a'), 'job_a')
+
+        # 'b' is least recently used:
+        result_cache.put('c', 'job_c')
+        self.assertEqual(result_cache.get('b'), None)
+        self.assertEqual(result_cache.get('c'), 'job_c')
+
+        result_cache.remove_job('job_c')
+        self.assertEqual(result_cache.get('c'), None)
+
+        self.assertEqual(result_cache.get_stats(),
+                         {'size': 1, 'max_size': 2, 'hits': 2, 'misses': 2,
+                          'hit_rate': 0.5})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+'''
+(c) University of Liverpool 2020
+
+Licensed under the MIT License.
+
+To view a copy of this license, visit <http://opensource.org/licenses/MIT/>..
+
+@author: neilswainston
+'''
+# pylint: disable=invalid-name
+from threading import Event
+import unittest
+
+from liv_covid19.web.executor import JobExecutor, QueueFullError
+
+
+class _Job():
+    '''Job recording its queue positions, and run once its gate is
+    open.'''
+
+    def __init__(self, gate):
+        self.positions = []
+        self.dequeued = False
+        self.started = Event()
+        self.done = Event()
+        self.__gate = gate
+
+    def set_queue_position(self, position):
+        '''Records queue position.'''
+        self.positions.append(position)
+
+    def set_dequeued(self):
+        '''Records job being taken from the queue.'''
+        self.dequeued = True
+
+    def run(self):
+        '''Run.'''
+        self.started.set()
+        self.__gate.wait()
+        self.done.set()
+
+
+class TestJobExecutor(unittest.TestCase):
+    '''Test class for JobExecutor.'''
+
+    def test_queue_full(self):
+        '''Tests rejection of jobs submitted to a full queue.'''
+        gate = Event()
+        executor = JobExecutor(1, 1)
+        running, queued, rejected = [_Job(gate) for _ in range(3)]
+
+        executor.submit(running)
+        running.started.wait()
+        executor.submit(queued)
+
+        self.assertRaises(QueueFullError, executor.submit, rejected)
+        self.assertFalse(executor.run(rejected))
+        self.assertEqual(executor.get_num_running(), 1)
+        self.assertEqual(executor.get_num_queued(), 1)
+
+        # Removing a queued job frees its place:
+        self.assertTrue(executor.remove(queued))
+        self.assertFalse(executor.remove(queued))
+        self.assertTrue(queued.dequeued)
+        executor.submit(rejected)
+
+        gate.set()
+        self.assertTrue(rejected.done.wait(10))
+        self.assertFalse(queued.done.is_set())
+
+    def test_positions(self):
+        '''Tests reporting of queue positions as jobs move up the queue.'''
+        gate = Event()
+        executor = JobExecutor(1, 3)
+        jobs = [_Job(gate) for _ in range(4)]
+
+        executor.submit(jobs[0])
+        jobs[0].started.wait()
+
+        for job in jobs[1:]:
+            executor.submit(job)
+
+        # Removing a job moves those behind it up:
+        executor.remove(jobs[2])
+        gate.set()
+        self.assertTrue(jobs[3].done.wait(10))
+
+        self.assertEqual([job.positions for job in jobs],
+                         [[1], [1, 1], [2], [3, 2, 1]])
+        self.assertEqual(executor.get_num_queued(), 0)
+
+    def test_run(self):
+        '''Tests running of jobs in the calling thread, in place of an idle
+        worker.'''
+        gate = Event()
+        gate.set()
+        executor = JobExecutor(1, 1)
+        job = _Job(gate)
+
+        self.assertTrue(executor.run(job))
+        self.assertTrue(job.done.is_set())
+        self.assertEqual(job.positions, [])
+        self.assertEqual(executor.get_num_running(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+'''
+(c) University of Liverpool 2020
+
+Licensed under the MIT License.
+
+To view a copy of this license, visit <http://opensource.org/licenses/MIT/>..
+
+@author: neilswainston
+'''
+# pylint: disable=invalid-name
+import itertools
+import json
+import os.path
+import tempfile
+import unittest
+from unittest import mock
+
+from liv_covid19.web import store
+
+
+class TestSQLiteJobStore(unittest.TestCase):
+    '''Test class for SQLiteJobStore, shared by two stores (as by two server
+    processes) on one database file.'''
+
+    def setUp(self):
+        filename = os.path.join(tempfile.mkdtemp(), 'jobs.db')
+        self.__store = store.SQLiteJobStore(filename, max_expired=2,
+                                            max_events=3)
+        self.__other = store.SQLiteJobStore(filename, max_expired=2,
+                                            max_events=3)
+
+        # Jobs end at increasing, whole-second times:
+        patcher = mock.patch('liv_covid19.web.store.time')
+        patcher.start().time.side_effect = itertools.count(1000)
+        self.addCleanup(patcher.stop)
+
+    def test_events(self):
+        '''Tests events being added by one store and read by the other.'''
+        self.__store.add_job('job')
+        self.assertEqual(self.__other.get_status('job'), ('submitted', None))
+
+        events = [_get_event('job', status) for status in
+                  ['queued', 'running', 'running', 'finished']]
+
+        for event_id, event in enumerate(events, 1):
+            self.assertEqual(self.__store.add_event('job', event),
+                             (event_id, store.get_frame(event_id,
+                                                        json.dumps(event))))
+
+        # Only the latest max_events events are kept:
+        self.assertEqual(self.__other.get_events('job'),
+                         list(enumerate(events, 1))[1:])
+        self.assertEqual(self.__other.get_events('job', 3),
+                         [(4, events[3])])
+        self.assertEqual(self.__other.get_status('job'),
+                         ('finished', events[3]))
+
+    def test_frames(self):
+        '''Tests that only the last event of an ended job ends its
+        frames.'''
+        self.__store.add_job('job')
+        self.__store.add_event('job', _get_event('job', 'running'))
+
+        self.assertEqual([end for _, _, end in self.__other.get_frames('job')],
+                         [False])
+
+        event = _get_event('job', 'finished')
+        self.__store.add_event('job', event)
+
+        self.assertEqual(self.__other.get_frames('job'),
+                         [(1, store.get_frame(1, json.dumps(
+                             _get_event('job', 'running'))), False),
+                          (2, store.get_frame(2, json.dumps(event)), True)])
+        self.assertEqual(self.__other.get_frames('job', 2), [])
+
+    def test_cancel(self):
+        '''Tests cancellation requested by the other store.'''
+        self.__store.add_job('job')
+        self.assertFalse(self.__store.is_cancel_requested('job'))
+
+        self.__other.request_cancel('job')
+        self.__other.request_cancel('unknown')
+
+        self.assertTrue(self.__store.is_cancel_requested('job'))
+        self.assertFalse(self.__store.is_cancel_requested('unknown'))
+
+        # Requests are dropped with their job:
+        self.__store.remove_job('job')
+        self.assertFalse(self.__store.is_cancel_requested('job'))
+        self.assertEqual(self.__other.get_status('job'), (None, None))
+
+    def test_prune_ttl(self):
+        '''Tests expiry of jobs that ended before the expiry time.'''
+        for job_id, status in [('old', 'finished'), ('new', 'error'),
+                               ('running', 'running')]:
+            self.__store.add_job(job_id)
+            self.__store.add_event(job_id, _get_event(job_id, status))
+
+        self.__store.set_result('old', 'old.zip')
+        self.__store.request_cancel('old')
+
+        # 'old' ended at 1000, 'new' at 1001:
+        self.assertEqual(self.__other.prune(1001, 100), ['old'])
+        self.assertEqual(self.__other.prune(1001, 100), [])
+
+        self.assertEqual(self.__store.get_status('old'),
+                         ('expired', 'finished'))
+        self.assertEqual(self.__store.get_events('old'), [])
+        self.assertEqual(self.__store.get_result('old'), None)
+        self.assertFalse(self.__store.is_cancel_requested('old'))
+        self.assertEqual(self.__store.get_status('new')[0], 'error')
+
+        # Running jobs never expire:
+        self.assertEqual(self.__other.prune(10000, 100), ['new'])
+        self.assertEqual(self.__store.get_status('running')[0], 'running')
+
+    def test_prune_max_jobs(self):
+        '''Tests expiry of the oldest ended jobs beyond the maximum number
+        of jobs.'''
+        job_ids = ['job_%i' % idx for idx in range(4)]
+
+        for job_id in job_ids:
+            self.__store.add_job(job_id)
+
+        for job_id in reversed(job_ids[1:]):
+            self.__store.add_event(job_id, _get_event(job_id, 'finished'))
+
+        # job_0 is running, and job_3 ended first:
+        self.assertCountEqual(self.__other.prune(0, 2), ['job_2', 'job_3'])
+        self.assertEqual([self.__store.get_status(job_id)[0]
+                          for job_id in job_ids],
+                         ['submitted', 'finished', 'expired', 'expired'])
+
+    def test_prune_max_expired(self):
+        '''Tests dropping of the oldest expired jobs beyond max_expired.'''
+        job_ids = ['job_%i' % idx for idx in range(3)]
+
+        for job_id in job_ids:
+            self.__store.add_job(job_id)
+            self.__store.add_event(job_id, _get_event(job_id, 'cancelled'))
+
+        self.assertCountEqual(self.__other.prune(10000, 100), job_ids)
+
+        # Unknown once dropped:
+        self.assertEqual([self.__store.get_status(job_id)
+                          for job_id in job_ids],
+                         [(None, None),
+                          ('expired', 'cancelled'),
+                          ('expired', 'cancelled')])
+
+
+def _get_event(job_id, status):
+    '''Gets event of job.'''
+    return {'job_id': job_id,
+            'update': {'status': status, 'message': status}}
+
+
+if __name__ == '__main__':
+    unittest.main()
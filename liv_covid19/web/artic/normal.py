@@ -8,50 +8,62 @@ To view a copy of this license, visit <http://opensource.org/licenses/MIT/>..
 @author: neilswainston
 '''
 # pylint: disable=invalid-name
+# pylint: disable=too-many-arguments
 # pylint: disable=wrong-import-order
-import os.path
+from collections import OrderedDict
 
 from liv_covid19.web.artic import utils
+from liv_covid19.web.progress import Progress
 import numpy as np
 import pandas as pd
 
 
-def run(in_filename, out_dir, target_mass, vol_scale, temp_deck):
-    '''run.'''
-    in_df = _get_data(in_filename)
+def run(content, target_mass, vol_scale, temp_deck, params_mode='inline',
+        progress=None):
+    '''Runs pipeline on (text, bytes or spooled file) file content, in
+    memory, returning OrderedDict of output file names and content.'''
+    if not progress:
+        progress = Progress()
 
-    # Check validity:
-    min_val = target_mass / 7.5
-    assert in_df.min().min() >= min_val, \
-        'Invalid concentration(s) of < %.2ful/ng detected' % min_val
+    files = OrderedDict()
 
-    # Convert to vol required for 50ng:
-    in_df = target_mass / in_df
+    with progress.stage('parse'):
+        in_df = _get_data(utils.get_buffer(content))
 
-    if not os.path.exists(out_dir):
-        os.makedirs(out_dir)
+        # Check validity:
+        min_val = target_mass / 7.5
+        assert in_df.min().min() >= min_val, \
+            'Invalid concentration(s) of < %.2ful/ng detected' % min_val
 
-    # Write Mantis worklist:
-    _get_mantis(in_df).to_csv(os.path.join(out_dir, 'mantis.csv'),
-                              index=False, header=False)
+    # Release input, which is no longer needed:
+    utils.release(content)
 
-    # Get tabular data:
-    tab_df = _to_tabular(in_df)
+    with progress.stage('plan'):
+        # Convert to vol required for 50ng:
+        in_df = target_mass / in_df
 
-    # Get Mosquito worklist:
-    mosquito_df = _get_mosquito(tab_df)
+        # Write Mantis worklist:
+        files['mantis.csv'] = \
+            _get_mantis(in_df).to_csv(index=False, header=False).encode()
 
-    # Write Mosquito plate:
-    mosquito_df.to_csv(os.path.join(out_dir, 'mosquito.csv'),
-                       index=False)
+        # Get tabular data:
+        tab_df = _to_tabular(in_df)
+
+        # Get Mosquito worklist:
+        mosquito_df = _get_mosquito(tab_df)
+
+        # Write Mosquito plate:
+        files['mosquito.csv'] = mosquito_df.to_csv(index=False).encode()
 
     # Write Opentrons worklist:
-    _get_ot(tab_df, temp_deck, vol_scale, out_dir)
+    _get_ot(tab_df, temp_deck, vol_scale, params_mode, files, progress)
 
+    return files
 
-def _get_data(in_filename):
+
+def _get_data(in_file):
     '''Get data.'''
-    in_df = pd.read_csv(in_filename, header=None)
+    in_df = pd.read_csv(in_file, header=None)
     in_df.dropna(axis=0, how='any', inplace=True)
     in_df.dropna(axis=1, how='any', inplace=True)
     in_df.index = [val + 1 for val in range(len(in_df))]
@@ -112,19 +124,24 @@ def _get_mosquito(tab_df, max_vol=12000):
     return df
 
 
-def _get_ot(df, temp_deck, vol_scale, out_dir):
+def _get_ot(df, temp_deck, vol_scale, params_mode, files, progress):
     '''Get OpenTrons worklists.'''
     resp = df.apply(_to_tuple, axis=1)
     dna_concs = dict(resp.tolist())
+    params = {}
 
     # Convert:
-    py_dir = 'liv_covid19/artic/opentrons/'
-
-    for filename in ['normalisation.py']:
-        utils.replace(os.path.join(py_dir, filename), out_dir,
-                      temp_deck=temp_deck,
-                      vol_scale=vol_scale,
-                      dna_concs=dna_concs)
+    for filename in utils.NORMAL_PROTOCOLS:
+        with progress.stage('render ' + filename):
+            params[filename] = utils.get_params(filename,
+                                                temp_deck=temp_deck,
+                                                vol_scale=vol_scale,
+                                                dna_concs=dna_concs)
+            files[filename] = utils.render(filename, params[filename],
+                                           params_mode)
+
+    if params_mode == 'block':
+        files['protocols.json'] = utils.get_manifest(params)
 
 
 def _to_tuple(row):
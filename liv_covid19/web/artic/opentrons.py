@@ -10,48 +10,66 @@ To view a copy of this license, visit <http://opensource.org/licenses/MIT/>..
 # pylint: disable=invalid-name
 # pylint: disable=too-many-arguments
 # pylint: disable=wrong-import-order
+from collections import OrderedDict
 import datetime
-import os.path
 import uuid
 
 from liv_covid19.web.artic import utils
+from liv_covid19.web.progress import Progress
 import pandas as pd
 
 
-def run(in_filename, temp_deck, vol_scale, out_dir):
-    '''run.'''
-    df = pd.read_csv(in_filename, dtype={'id': object, 'plate_id': object})
+def run(content, temp_deck, vol_scale, params_mode='inline', progress=None):
+    '''Runs pipeline on (text, bytes or spooled file) file content, in
+    memory, returning OrderedDict of output file names and content.'''
+    if not progress:
+        progress = Progress()
 
-    # Generate unique destination plate id:
-    dst_plt_id = '%s-%s' % (datetime.datetime.now().strftime('%Y%m%d'),
-                            str(uuid.uuid4())[:8])
+    files = OrderedDict()
 
-    # Select valid wells (those that are non-negative):
-    dst_wells = _get_wells(df[df['status'] != 'NEG'])
+    with progress.stage('parse'):
+        df = pd.read_csv(utils.get_buffer(content),
+                         dtype={'id': object, 'plate_id': object})
 
-    # Update the DataFrame:
-    df.loc[df['status'] != 'NEG', 'dest_plate_id'] = dst_plt_id
-    df.loc[df['status'] != 'NEG', 'dest_well'] = dst_wells
+    # Release input, which is no longer needed:
+    utils.release(content)
 
-    # Create 'out' directory if it does not exist:
-    if not os.path.exists(out_dir):
-        os.makedirs(out_dir)
+    with progress.stage('plan'):
+        # Generate unique destination plate id:
+        dst_plt_id = '%s-%s' % (datetime.datetime.now().strftime('%Y%m%d'),
+                                str(uuid.uuid4())[:8])
 
-    # Write updated DataFrame:
-    df.to_csv(os.path.join(out_dir, '%s.csv' % dst_plt_id), index=False)
+        # Select valid wells (those that are non-negative):
+        dst_wells = _get_wells(df[df['status'] != 'NEG'])
 
-    # Get OpenTrons worklist Python scripts:
-    last_well = dst_wells[-1]
+        # Update the DataFrame:
+        df.loc[df['status'] != 'NEG', 'dest_plate_id'] = dst_plt_id
+        df.loc[df['status'] != 'NEG', 'dest_well'] = dst_wells
 
-    rna_plate_wells = {
-        key: grp_df['well'].to_list()
-        for key, grp_df in df[df['status'] != 'NEG'].groupby('plate_id')}
+        # Write updated DataFrame:
+        files['%s.csv' % dst_plt_id] = df.to_csv(index=False).encode()
 
-    for filename in [
-            'barcode.py', 'cdna_pcr.py', 'cleanup.py', 'picker.py', 'pool.py']:
-        utils.replace(os.path.join('liv_covid19/artic/opentrons/', filename),
-                      out_dir, rna_plate_wells, last_well, temp_deck,
-                      vol_scale)
+        # Get OpenTrons worklist Python scripts:
+        last_well = dst_wells[-1]
+
+        rna_plate_wells = {
+            key: grp_df['well'].to_list()
+            for key, grp_df in df[df['status'] != 'NEG'].groupby('plate_id')}
+
+    params = {}
+
+    for filename in utils.OPENTRONS_PROTOCOLS:
+        with progress.stage('render ' + filename):
+            params[filename] = utils.get_params(filename, rna_plate_wells,
+                                                last_well, temp_deck,
+                                                vol_scale)
+            files[filename] = utils.render(filename, params[filename],
+                                           params_mode)
+
+    if params_mode == 'block':
+        files['protocols.json'] = utils.get_manifest(params)
+
+    return files
 
 
 def _get_wells(df):
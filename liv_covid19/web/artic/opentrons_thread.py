@@ -8,53 +8,67 @@ To view a copy of this license, visit <http://opensource.org/licenses/MIT/>..
 @author: neilswainston
 '''
 # pylint: disable=broad-except
-import os.path
-import tempfile
+# pylint: disable=import-outside-toplevel
+from concurrent.futures import CancelledError
 
-from liv_covid19.web.artic import opentrons
-from liv_covid19.web.job import JobThread, save_export
+from liv_covid19.web.artic import utils
+from liv_covid19.web.job import JobThread, ResultBundle
 
 
-class OpentronsThread(JobThread):
-    '''Runs a Opentrons job.'''
+_STAGES = ['parse', 'plan'] + \
+    ['render ' + filename for filename in utils.OPENTRONS_PROTOCOLS] + \
+    ['bundle']
 
-    def __init__(self, query, out_dir):
-        self.__filename, suffix = os.path.splitext(query['file_name'])
 
-        tmpfile = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
-        self.__in_filename = tmpfile.name
-
-        with open(self.__in_filename, 'w') as fle:
-            fle.write(query['file_content'])
+class OpentronsThread(JobThread):
+    '''Runs a Opentrons job.'''
 
+    def __init__(self, query, content):
+        self.__content = content
         self.__temp_deck = query['temp_deck']
         self.__vol_scale = float(query['vol_scale'])
+        self.__params_mode = query.get('params_mode', 'inline')
+
+        if self.__params_mode not in utils.PARAMS_MODES:
+            raise ValueError('Invalid params_mode: %s' % self.__params_mode)
 
-        self.__out_dir = out_dir
-        JobThread.__init__(self, query, 1)
+        JobThread.__init__(self, query, len(_STAGES), validates=True)
 
     def run(self):
         '''Run.'''
+        # Import pipeline (and so pandas) only when a job is run:
+        from liv_covid19.web.artic import opentrons
+
         try:
-            parent_dir = tempfile.mkdtemp()
-            iteration = 0
-
-            self._fire_job_event('running', iteration, 'Running...')
-
-            opentrons.run(in_filename=self.__in_filename,
-                          temp_deck=self.__temp_deck,
-                          vol_scale=self.__vol_scale,
-                          out_dir=parent_dir)
-
-            iteration += 1
-
-            if self._cancelled:
-                self._fire_job_event('cancelled', iteration,
-                                     message='Job cancelled')
-            else:
-                save_export(parent_dir, self.__out_dir, self._job_id)
-                self._result = self._job_id
-                self._fire_job_event('finished', iteration,
-                                     message='Job completed')
+            # Job may have been cancelled while queued:
+            self._checkpoint()
+            self._fire_job_event('running', 0, 'Running...')
+
+            files = self._call(opentrons.run,
+                               content=self.__content,
+                               temp_deck=self.__temp_deck,
+                               vol_scale=self.__vol_scale,
+                               params_mode=self.__params_mode)
+
+            self._validate({name: files[name]
+                            for name in utils.OPENTRONS_PROTOCOLS})
+
+            with self._stage('bundle'):
+                bundle = ResultBundle()
+                bundle.add_files(files, self._checkpoint)
+                self._add_profile(bundle)
+                self._add_validation(bundle)
+
+            self._bundle = bundle
+            self._result = self._job_id
+            self._fire_job_event('finished', self._iteration,
+                                 message='Job completed')
+        except CancelledError:
+            self._fire_job_event('cancelled', self._iteration,
+                                 message='Job cancelled')
         except Exception as err:
-            self._fire_job_event('error', iteration, message=str(err))
+            self._fire_job_event('error', self._iteration, message=str(err))
+        finally:
+            # Release input (if not already released, once parsed):
+            utils.release(self.__content)
+            self.__content = None
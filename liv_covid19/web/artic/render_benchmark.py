@@ -0,0 +1,84 @@
+'''
+(c) University of Liverpool 2020
+
+Licensed under the MIT License.
+
+To view a copy of this license, visit <http://opensource.org/licenses/MIT/>..
+
+@author: neilswainston
+'''
+# pylint: disable=too-many-arguments
+import os.path
+import sys
+import timeit
+
+from liv_covid19.web.artic import utils
+
+
+def scan(flnme_in, rna_plate_wells, last_well, temp_deck, vol_scale,
+         dna_concs):
+    '''Renders protocol with the previous line scanner, which reread the
+    template and checked every line for every parameter.'''
+    out = []
+
+    with open(flnme_in, 'rt') as file_in:
+        for line in file_in:
+            line = '_SAMPLE_PLATE_LAST = \'%s\'' % last_well \
+                if line.startswith('_SAMPLE_PLATE_LAST') else line
+
+            line = '_RNA_PLATE_WELLS = %s' % rna_plate_wells \
+                if line.startswith('_RNA_PLATE_WELLS') else line
+
+            line = '_TEMP_DECK = \'%s\'' % temp_deck \
+                if line.startswith('_TEMP_DECK') else line
+
+            line = '_VOL_SCALE = %f' % vol_scale \
+                if line.startswith('_VOL_SCALE') else line
+
+            line = '_DNA_VOLS = %s' % dna_concs \
+                if line.startswith('_DNA_VOLS') else line
+
+            out.append(line)
+
+    return ''.join(out).encode()
+
+
+def main(args):
+    '''main method: renders all protocols args[0] (default 1000) times with
+    the line scanner and the compiled templates, checking that both give
+    identical scripts, and reports their times.'''
+    number = int(args[0]) if args else 1000
+
+    params = {'rna_plate_wells': {'plate_%i' % plt: ['A1', 'B1', 'H12']
+                                  for plt in range(1, 5)},
+              'last_well': 'D12',
+              'temp_deck': 'tempdeck',
+              'vol_scale': 0.5,
+              'dna_concs': {'A%i' % col: 2.5 for col in range(1, 13)}}
+
+    filenames = utils.NORMAL_PROTOCOLS + utils.OPENTRONS_PROTOCOLS
+
+    for filename in filenames:
+        assert scan(os.path.join(utils.TEMPLATE_DIR, filename), **params) == \
+            utils.render(filename, utils.get_params(filename, **params)), \
+            filename
+
+    scanner = timeit.timeit(
+        lambda: [scan(os.path.join(utils.TEMPLATE_DIR, filename), **params)
+                 for filename in filenames], number=number)
+
+    compiled = timeit.timeit(
+        lambda: [utils.render(filename, utils.get_params(filename, **params))
+                 for filename in filenames],
+        number=number)
+
+    print('%i renders of %i protocols: line scanner %.1fus, '
+          'compiled templates %.1fus per protocol (%.1fx faster)' %
+          (number, len(filenames),
+           scanner / number / len(filenames) * 1e6,
+           compiled / number / len(filenames) * 1e6,
+           scanner / compiled))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
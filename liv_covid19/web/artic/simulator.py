@@ -0,0 +1,289 @@
+'''
+(c) University of Liverpool 2020
+
+Licensed under the MIT License.
+
+To view a copy of this license, visit <http://opensource.org/licenses/MIT/>..
+
+@author: neilswainston
+'''
+# pylint: disable=broad-except
+# pylint: disable=import-outside-toplevel
+from collections import OrderedDict
+from concurrent.futures import CancelledError
+import functools
+import hashlib
+import io
+import json
+import os
+import sqlite3
+from threading import local, Lock
+import time
+import traceback
+
+from liv_covid19.web.process_pool import ProcessPool
+
+
+# Directory of custom labware definitions, one folder per labware:
+PLATES_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))),
+    'plates')
+
+# Labware definition folders, as loaded by a warmed worker process:
+_LABWARE_PATHS = []
+
+
+class Simulator():
+    '''Validates protocol scripts in a pool of simulator processes, caching
+    results (if a cache is given).'''
+
+    def __init__(self, max_workers, plates_dir=PLATES_DIR, cache=None):
+        self.__pool = ProcessPool(
+            max_workers, ['opentrons.simulate'],
+            initializer=functools.partial(_load_labware, plates_dir))
+        self.__cache = cache
+        self.__plates_dir = plates_dir
+        self.__environment = None
+        self.__lock = Lock()
+
+    def warm(self):
+        '''Starts (and warms) worker processes now, rather than on first
+        validation.'''
+        self.__pool.warm()
+
+    def validate(self, scripts, checkpoint=None):
+        '''Simulates protocol scripts, from dict of names and content,
+        returning OrderedDict of names and results.'''
+        environment = self.__get_environment() if self.__cache else None
+        keys = {name: self.__get_key(environment, content)
+                for name, content in scripts.items()}
+        results = OrderedDict((name, self.__get_cached(keys[name]))
+                              for name in scripts)
+
+        futures = OrderedDict((name, self.__pool.submit(simulate, name,
+                                                        content))
+                              for name, content in scripts.items()
+                              if not results[name])
+
+        try:
+            for name, future in futures.items():
+                if checkpoint:
+                    checkpoint()
+
+                results[name] = future.result()
+
+                if keys[name]:
+                    self.__cache.put(keys[name], results[name])
+
+                results[name]['cached'] = False
+        except CancelledError:
+            for future in futures.values():
+                future.cancel()
+
+            raise
+
+        return results
+
+    def get_cache_stats(self):
+        '''Gets simulation cache statistics.'''
+        return self.__cache.get_stats() if self.__cache else {}
+
+    def __get_environment(self):
+        '''Gets fingerprint of simulation environment, asking a worker for
+        the opentrons version if its package metadata cannot be read, or
+        None if the version is unknown.'''
+        with self.__lock:
+            if not self.__environment:
+                version = _get_version() or \
+                    self.__pool.submit(_get_worker_version).result()
+
+                if version:
+                    self.__environment = _get_environment(version,
+                                                          self.__plates_dir)
+
+            return self.__environment
+
+    @staticmethod
+    def __get_key(environment, content):
+        '''Gets cache key of script content, or None (not to be cached) if
+        the simulation environment is unknown.'''
+        if not environment:
+            return None
+
+        return hashlib.sha256(environment.encode() + content).hexdigest()
+
+    def __get_cached(self, key):
+        '''Gets cached result, or None.'''
+        result = self.__cache.get(key) if key else None
+
+        if result:
+            result['cached'] = True
+
+        return result
+
+
+class SimulationCache():
+    '''LRU cache of simulation results, in a SQLite database.'''
+
+    def __init__(self, filename, max_bytes=256 * 1024 ** 2):
+        self.__filename = filename
+        self.__max_bytes = max_bytes
+        self.__local = local()
+        self.__hits = 0
+        self.__misses = 0
+        self.__lock = Lock()
+
+        with self.__get_conn() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS simulations ('
+                         'key TEXT PRIMARY KEY, '
+                         'result TEXT NOT NULL, '
+                         'size INTEGER NOT NULL, '
+                         'used REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS simulations_used '
+                         'ON simulations (used)')
+
+    def get(self, key):
+        '''Gets result cached against key, or None.'''
+        with self.__get_conn() as conn:
+            # Mark as used before reading, so that the write lock is taken
+            # first:
+            used = conn.execute('UPDATE simulations SET used = ? '
+                                'WHERE key = ?',
+                                (time.time(), key)).rowcount
+
+            row = conn.execute('SELECT result FROM simulations '
+                               'WHERE key = ?', (key,)).fetchone() \
+                if used else None
+
+        with self.__lock:
+            if row:
+                self.__hits += 1
+            else:
+                self.__misses += 1
+
+        return json.loads(row[0]) if row else None
+
+    def put(self, key, result):
+        '''Caches result against key, evicting the least recently used
+        beyond the size cap.'''
+        data = json.dumps(result)
+
+        with self.__get_conn() as conn:
+            conn.execute('INSERT OR REPLACE INTO simulations '
+                         'VALUES (?, ?, ?, ?)',
+                         (key, data, len(data), time.time()))
+
+            total = 0
+            evicted = []
+
+            for old_key, size in conn.execute(
+                    'SELECT key, size FROM simulations ORDER BY used DESC'):
+                total += size
+
+                if total > self.__max_bytes:
+                    evicted.append((old_key,))
+
+            conn.executemany('DELETE FROM simulations WHERE key = ?',
+                             evicted)
+
+    def get_stats(self):
+        '''Gets cache statistics.'''
+        size, num_bytes = self.__get_conn().execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) '
+            'FROM simulations').fetchone()
+
+        with self.__lock:
+            requests = self.__hits + self.__misses
+
+            return {'size': size,
+                    'bytes': num_bytes,
+                    'max_bytes': self.__max_bytes,
+                    'hits': self.__hits,
+                    'misses': self.__misses,
+                    'hit_rate': (float(self.__hits) / requests
+                                 if requests else 0.0)}
+
+    def __get_conn(self):
+        '''Gets connection of current thread (a context manager committing,
+        or rolling back, a transaction).'''
+        if not hasattr(self.__local, 'conn'):
+            self.__local.conn = sqlite3.connect(self.__filename, timeout=30)
+            self.__local.conn.execute('PRAGMA journal_mode=WAL')
+
+        return self.__local.conn
+
+
+def simulate(name, content):
+    '''Simulates protocol script in a worker process, returning its result:
+    whether it passed, its number of commands, its runlog (or error) and the
+    duration of simulation.'''
+    from opentrons import simulate as ot_simulate
+
+    start = time.time()
+
+    try:
+        runlog, _ = ot_simulate.simulate(
+            io.StringIO(content.decode()), name,
+            custom_labware_paths=_LABWARE_PATHS)
+        result = {'passed': True,
+                  'commands': len(runlog),
+                  'runlog': ot_simulate.format_runlog(runlog)}
+    except Exception:
+        result = {'passed': False,
+                  'commands': None,
+                  'runlog': traceback.format_exc()}
+
+    result['duration'] = time.time() - start
+    return result
+
+
+def _load_labware(plates_dir):
+    '''Loads (and so checks) custom labware definitions in a new worker
+    process.'''
+    from opentrons import simulate as ot_simulate
+
+    # Definitions are only read from the top level of each folder:
+    _LABWARE_PATHS[:] = [os.path.join(plates_dir, name)
+                         for name in sorted(os.listdir(plates_dir))
+                         if os.path.isdir(os.path.join(plates_dir, name))]
+
+    ot_simulate.labware_from_paths(_LABWARE_PATHS)
+
+
+def _get_worker_version():
+    '''Gets opentrons version in a (warmed) worker process, or None.'''
+    import opentrons
+    return getattr(opentrons, '__version__', None)
+
+
+def _get_version():
+    '''Gets opentrons version from its package metadata (without importing
+    it), or None.'''
+    try:
+        # Python 3.8+:
+        from importlib import metadata
+        return metadata.version('opentrons')
+    except Exception:
+        pass
+
+    try:
+        import pkg_resources
+        return pkg_resources.get_distribution('opentrons').version
+    except Exception:
+        return None
+
+
+def _get_environment(version, plates_dir):
+    '''Gets fingerprint of simulation environment: the opentrons version and
+    custom labware definitions.'''
+    digest = hashlib.sha256()
+
+    for path, dirs, filenames in os.walk(plates_dir):
+        dirs.sort()
+
+        for filename in sorted(filenames):
+            with open(os.path.join(path, filename), 'rb') as fle:
+                digest.update(filename.encode() + fle.read())
+
+    return '%s-%s' % (version, digest.hexdigest())
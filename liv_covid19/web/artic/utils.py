@@ -8,39 +8,174 @@ To view a copy of this license, visit <http://opensource.org/licenses/MIT/>..
 @author: neilswainston
 '''
 # pylint: disable=too-many-arguments
+import hashlib
+import io
+import json
 import os.path
 
 
-def replace(flnme_in, out_dir,
-            rna_plate_wells=None,
-            last_well='H12',
-            temp_deck='tempdeck',
-            vol_scale=1.0,
-            dna_concs=None):
-    '''Replace.'''
+# Opentrons protocol scripts rendered by each pipeline (held here, rather
+# than in the pipeline modules, so that job threads can count their stages
+# without importing pandas):
+NORMAL_PROTOCOLS = ['normalisation.py']
+
+OPENTRONS_PROTOCOLS = ['barcode.py', 'cdna_pcr.py', 'cleanup.py',
+                       'picker.py', 'pool.py']
+
+# Directory of protocol templates, within the package:
+TEMPLATE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__)))),
+    'artic', 'opentrons')
+
+# Protocol parameters, assigned at the start of a template line:
+SLOT_NAMES = ['_SAMPLE_PLATE_LAST', '_RNA_PLATE_WELLS', '_TEMP_DECK',
+              '_VOL_SCALE', '_DNA_VOLS']
+
+# Formats of protocol parameters, rendered inline:
+_FORMATS = {'_SAMPLE_PLATE_LAST': '_SAMPLE_PLATE_LAST = \'%s\'',
+            '_RNA_PLATE_WELLS': '_RNA_PLATE_WELLS = %s',
+            '_TEMP_DECK': '_TEMP_DECK = \'%s\'',
+            '_VOL_SCALE': '_VOL_SCALE = %f',
+            '_DNA_VOLS': '_DNA_VOLS = %s'}
+
+# Data block of protocol parameters, overriding those declared above it:
+PARAMS_SLOT = '_PARAMS'
+
+# Modes of rendering protocol parameters: inline (assigned where declared)
+# or block (in the data block, leaving the code body unchanged):
+PARAMS_MODES = ['inline', 'block']
+
+
+def get_buffer(content):
+    '''Gets file buffer of (text, bytes or spooled file) file content.'''
+    if isinstance(content, bytes):
+        return io.BytesIO(content)
+
+    if isinstance(content, str):
+        return io.StringIO(content)
+
+    return content
+
+
+def release(content):
+    '''Releases file content once parsed, closing (so freeing the memory,
+    or deleting the disk file, of) a spooled file.'''
+    if hasattr(content, 'close'):
+        content.close()
+
+
+def get_params(filename,
+               rna_plate_wells=None,
+               last_well='H12',
+               temp_deck='tempdeck',
+               vol_scale=1.0,
+               dna_concs=None):
+    '''Gets parameters of protocol template, as dict of slot names and
+    values (of those slots in the template only).'''
     if not rna_plate_wells:
         rna_plate_wells = {'plate_1': []}
 
     if not dna_concs:
         dna_concs = {}
 
-    flnme_out = os.path.join(out_dir, os.path.basename(flnme_in))
+    params = {'_SAMPLE_PLATE_LAST': last_well,
+              '_RNA_PLATE_WELLS': rna_plate_wells,
+              '_TEMP_DECK': temp_deck,
+              '_VOL_SCALE': vol_scale,
+              '_DNA_VOLS': dna_concs}
+
+    slot_names = TEMPLATES[filename].get_slot_names()
+
+    return {name: value for name, value in params.items()
+            if name in slot_names}
+
+
+def render(filename, params, params_mode='inline'):
+    '''Renders protocol template, returning its content.'''
+    if params_mode not in PARAMS_MODES:
+        raise ValueError('Invalid params_mode: %s' % params_mode)
+
+    if params_mode == 'block':
+        return TEMPLATES[filename].render({
+            PARAMS_SLOT: '%s = %s\n' % (
+                PARAMS_SLOT,
+                json.dumps(params, sort_keys=True, separators=(',', ':')))})
+
+    return TEMPLATES[filename].render({
+        name: _FORMATS[name] % (value,) for name, value in params.items()})
+
+
+def get_manifest(params):
+    '''Gets manifest (JSON) of protocols, from dict of file names and their
+    parameters, listing the digest of each code body (the script as rendered
+    in block mode, with an empty data block) and its parameters.'''
+    return json.dumps({filename: {'code_sha256':
+                                  TEMPLATES[filename].get_digest(),
+                                  'params': file_params}
+                       for filename, file_params in params.items()},
+                      indent=2, sort_keys=True).encode()
+
+
+class Template():
+    '''Protocol template, compiled into fixed segments and named slots.'''
+
+    def __init__(self, lines, slot_names=None):
+        if not slot_names:
+            slot_names = SLOT_NAMES + [PARAMS_SLOT]
+
+        self.__parts = []
+        self.__slots = []
+        segment = []
+
+        for line in lines:
+            slot_name = next((name for name in slot_names
+                              if line.startswith(name)), None)
+
+            if slot_name:
+                self.__parts.append(''.join(segment))
+                self.__slots.append((len(self.__parts), slot_name))
+                self.__parts.append(line)
+                segment = []
+            else:
+                segment.append(line)
+
+        self.__parts.append(''.join(segment))
+
+        # Digest of code body, as declared:
+        self.__digest = hashlib.sha256(''.join(self.__parts).encode()) \
+            .hexdigest()
+
+    def get_slot_names(self):
+        '''Gets names of slots, in order.'''
+        return [name for _, name in self.__slots]
+
+    def get_digest(self):
+        '''Gets (sha256 hex) digest of code body, with slots as declared.'''
+        return self.__digest
+
+    def render(self, values):
+        '''Renders template, filling slots from dict of values.'''
+        parts = list(self.__parts)
+
+        for idx, name in self.__slots:
+            if name in values:
+                parts[idx] = values[name]
+
+        return ''.join(parts).encode()
 
-    with open(flnme_in, 'rt') as file_in, open(flnme_out, 'wt') as file_out:
-        for line in file_in:
-            line = '_SAMPLE_PLATE_LAST = \'%s\'' % last_well \
-                if line.startswith('_SAMPLE_PLATE_LAST') else line
 
-            line = '_RNA_PLATE_WELLS = %s' % rna_plate_wells \
-                if line.startswith('_RNA_PLATE_WELLS') else line
+def _load_templates():
+    '''Loads and compiles protocol templates, from the package (rather than
+    the working directory).'''
+    templates = {}
 
-            line = '_TEMP_DECK = \'%s\'' % temp_deck \
-                if line.startswith('_TEMP_DECK') else line
+    for filename in NORMAL_PROTOCOLS + OPENTRONS_PROTOCOLS:
+        with open(os.path.join(TEMPLATE_DIR, filename), 'rt') as fle:
+            templates[filename] = Template(fle)
 
-            line = '_VOL_SCALE = %f' % vol_scale \
-                if line.startswith('_VOL_SCALE') else line
+    return templates
 
-            line = '_DNA_VOLS = %s' % dna_concs \
-                if line.startswith('_DNA_VOLS') else line
 
-            file_out.write(line)
+# Protocol templates, compiled once, at start up:
+TEMPLATES = _load_templates()
@@ -0,0 +1,267 @@
+'''
+(c) University of Liverpool 2020
+
+Licensed under the MIT License.
+
+To view a copy of this license, visit <http://opensource.org/licenses/MIT/>..
+
+@author: neilswainston
+'''
+# pylint: disable=broad-except
+from collections import OrderedDict
+import copy
+import json
+import os.path
+from threading import Lock, RLock
+
+from liv_covid19.web.executor import QueueFullError
+from liv_covid19.web.job import END_STATUSES, JobThread, ResultBundle
+
+
+class BatchJob(JobThread):
+    '''Aggregates the jobs of a batch of plates into a single job.'''
+
+    def __init__(self, query, num_plates, get_bundle, cancel_job,
+                 submit_plate):
+        JobThread.__init__(self, query, num_plates)
+        self.__num_plates = num_plates
+        self.__get_bundle = get_bundle
+        self.__cancel_job = cancel_job
+        self.__submit_plate = submit_plate
+        self.__plates = OrderedDict()
+        self.__pending = OrderedDict()
+        self.__bundles = {}
+        self.__in_flight = None
+        self.__feeding = False
+        self.__refeed = False
+        self.__num_updates = 0
+        self.__last_fired = 0
+        self.__lock = Lock()
+        self.__fire_lock = RLock()
+
+    def add_plate(self, file_name, query, content, digest):
+        '''Adds plate, of spooled file content and its digest, pending
+        submission.'''
+        name = os.path.splitext(os.path.basename(file_name))[0]
+        unique_name = name
+        idx = 1
+
+        while unique_name in self.__plates:
+            idx += 1
+            unique_name = '%s_%i' % (name, idx)
+
+        self.__plates[unique_name] = {'file_name': file_name,
+                                      'job_id': None,
+                                      'status': 'pending',
+                                      'message': 'Waiting to be queued...'}
+
+        self.__pending[unique_name] = (query, content, digest)
+
+    def feed(self):
+        '''Submits pending plates, in order, until the job queue is full,
+        returning whether every plate has been submitted.'''
+        with self.__lock:
+            # Submitting a plate may fire events that feed again, and other
+            # threads may feed meanwhile, so have this feed try again:
+            if self.__feeding:
+                self.__refeed = True
+                return False
+
+            self.__feeding = True
+
+        try:
+            while self.__feed_next():
+                pass
+        finally:
+            with self.__lock:
+                self.__feeding = False
+                refeed = self.__refeed
+                done = not self.__pending
+
+        # Feed again if capacity was freed after the queue was found full:
+        return self.feed() if refeed and not done else done
+
+    def get_app(self):
+        '''Gets app of job.'''
+        return 'Batch'
+
+    def set_running(self):
+        '''Reports batch as running.'''
+        self._fire_job_event('running', 0, 'Running...')
+
+    def cancel(self):
+        '''Cancels the batch, and the jobs of its plates.'''
+        JobThread.cancel(self)
+
+        with self.__lock:
+            # Plates being submitted are left to their feed:
+            pending = [(name, plate)
+                       for name, plate in self.__pending.items()
+                       if name != self.__in_flight]
+
+            for name, _ in pending:
+                del self.__pending[name]
+
+            job_ids = [plate['job_id'] for plate in self.__plates.values()
+                       if plate['job_id']]
+
+        for job_id in job_ids:
+            self.__cancel_job(job_id)
+
+        for name, (_, content, _) in pending:
+            _release(content)
+            self.plate_event_fired(name, {'job_id': None,
+                                          'update': {'status': 'cancelled',
+                                                     'message':
+                                                     'Job cancelled'}})
+
+    def plate_event_fired(self, name, event):
+        '''Responds to event being fired by the job of a plate.'''
+        # Check for cancellation requested by another server process:
+        self._is_cancelled()
+
+        status = event['update']['status']
+        bundle = self.__get_bundle(event['job_id']) \
+            if status == 'finished' else None
+
+        with self.__lock:
+            plate = self.__plates[name]
+            plate['job_id'] = event['job_id']
+            plate['status'] = status
+            plate['message'] = event['update']['message']
+
+            if status not in END_STATUSES:
+                return
+
+            if bundle:
+                self.__bundles[name] = bundle
+
+            num_ended = len([plt for plt in self.__plates.values()
+                             if plt['status'] in END_STATUSES])
+            self.__num_updates += 1
+            update = self.__num_updates
+
+        with self.__fire_lock:
+            # Skip updates overtaken by those of plates that ended later:
+            if update < self.__last_fired:
+                return
+
+            self.__last_fired = update
+
+            if num_ended < self.__num_plates:
+                self._fire_job_event('running', num_ended,
+                                     '%i of %i plates completed'
+                                     % (num_ended, self.__num_plates))
+            else:
+                self.__end()
+
+    def _fire_event(self, event):
+        '''Adds plate statuses to event, and fires it.'''
+        with self.__lock:
+            event['batch'] = copy.deepcopy(self.__plates)
+
+        JobThread._fire_event(self, event)
+
+    def __feed_next(self):
+        '''Submits next pending plate, returning whether to carry on.'''
+        with self.__lock:
+            self.__refeed = False
+
+            if not self.__pending or self._cancelled:
+                return False
+
+            # Keep plate pending until submitted, so that the batch is not
+            # taken to be fed meanwhile:
+            name, plate = next(iter(self.__pending.items()))
+            self.__in_flight = name
+
+        query, content, digest = plate
+
+        try:
+            job_id = self.__submit_plate(query, content, digest,
+                                         _PlateListener(self, name))
+        except QueueFullError:
+            with self.__lock:
+                self.__in_flight = None
+
+                if not self._cancelled:
+                    # Carry on if capacity was freed since:
+                    return self.__refeed
+
+                del self.__pending[name]
+
+            # Cancelled meanwhile:
+            _release(content)
+            self.plate_event_fired(name, {'job_id': None,
+                                          'update': {'status': 'cancelled',
+                                                     'message':
+                                                     'Job cancelled'}})
+            return False
+        except Exception as err:
+            self.__submitted(name)
+            _release(content)
+            self.plate_event_fired(name, {'job_id': None,
+                                          'update': {'status': 'error',
+                                                     'message': str(err)}})
+            return True
+
+        self.__submitted(name)
+
+        # Cancel job if the batch was cancelled while submitting it:
+        if self._cancelled:
+            self.__cancel_job(job_id)
+
+        return True
+
+    def __submitted(self, name):
+        '''Removes plate from those pending, once submitted.'''
+        with self.__lock:
+            self.__in_flight = None
+            del self.__pending[name]
+
+    def __end(self):
+        '''Ends batch, once all plate jobs have ended.'''
+        with self.__lock:
+            ended = list(self.__plates.values())
+            failed = [plt for plt in ended if plt['status'] != 'finished']
+
+        if self._cancelled:
+            self._fire_job_event('cancelled', len(ended),
+                                 message='Job cancelled')
+        elif len(failed) == len(ended):
+            self._fire_job_event('error', len(ended),
+                                 message='All plates failed')
+        else:
+            # Add plates in submission order, so that bundles are
+            # deterministic:
+            batch_bundle = ResultBundle()
+
+            for name in self.__plates:
+                if name in self.__bundles:
+                    batch_bundle.add_bundle(self.__bundles[name], name + '/')
+
+            batch_bundle.add(
+                'batch.json', json.dumps(self.__plates, indent=2).encode())
+            self.__bundles.clear()
+            self._bundle = batch_bundle
+            self._result = self._job_id
+            self._fire_job_event('finished', len(ended),
+                                 message='Job completed (%i of %i plates '
+                                 'failed)' % (len(failed), len(ended)))
+
+
+def _release(content):
+    '''Releases spooled file content of plate that will not be run.'''
+    content.close()
+
+
+class _PlateListener():
+    '''Passes events of a plate's job on to its batch.'''
+
+    def __init__(self, batch_job, name):
+        self.__batch_job = batch_job
+        self.__name = name
+
+    def event_fired(self, event):
+        '''Responds to event being fired.'''
+        self.__batch_job.plate_event_fired(self.__name, event)
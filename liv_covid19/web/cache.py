@@ -0,0 +1,80 @@
+'''
+(c) University of Liverpool 2020
+
+Licensed under the MIT License.
+
+To view a copy of this license, visit <http://opensource.org/licenses/MIT/>..
+
+@author: neilswainston
+'''
+from collections import OrderedDict
+import hashlib
+import json
+from threading import Lock
+
+
+class ResultCache():
+    '''LRU cache of completed job ids, keyed on submission content.'''
+
+    def __init__(self, max_size):
+        self.__max_size = max_size
+        self.__entries = OrderedDict()
+        self.__hits = 0
+        self.__misses = 0
+        self.__lock = Lock()
+
+    def get(self, key):
+        '''Gets job id cached against key, or None.'''
+        with self.__lock:
+            job_id = self.__entries.get(key)
+
+            if job_id:
+                self.__entries.move_to_end(key)
+                self.__hits += 1
+            else:
+                self.__misses += 1
+
+            return job_id
+
+    def put(self, key, job_id):
+        '''Caches job id against key, evicting the least recently used.'''
+        with self.__lock:
+            self.__entries[key] = job_id
+            self.__entries.move_to_end(key)
+
+            while len(self.__entries) > self.__max_size:
+                self.__entries.popitem(last=False)
+
+    def remove_job(self, job_id):
+        '''Removes entries for job id.'''
+        with self.__lock:
+            for key in [key for key, value in self.__entries.items()
+                        if value == job_id]:
+                del self.__entries[key]
+
+    def get_stats(self):
+        '''Gets cache statistics.'''
+        with self.__lock:
+            requests = self.__hits + self.__misses
+
+            return {'size': len(self.__entries),
+                    'max_size': self.__max_size,
+                    'hits': self.__hits,
+                    'misses': self.__misses,
+                    'hit_rate': (float(self.__hits) / requests
+                                 if requests else 0.0)}
+
+
+def get_key(query, file_digest):
+    '''Gets cache key of query (app and parameters) and file digest.'''
+    params = {key: value for key, value in query.items()
+              if key not in ['file_name', 'file_content']}
+
+    # Normalise numeric parameters, which may be submitted as strings:
+    for key in ['target_mass', 'vol_scale']:
+        if key in params:
+            params[key] = float(params[key])
+
+    return hashlib.sha256(
+        (json.dumps(params, sort_keys=True) + file_digest).encode()) \
+        .hexdigest()
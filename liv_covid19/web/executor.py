@@ -0,0 +1,117 @@
+'''
+(c) University of Liverpool 2020
+
+Licensed under the MIT License.
+
+To view a copy of this license, visit <http://opensource.org/licenses/MIT/>..
+
+@author: neilswainston
+'''
+from collections import deque
+from threading import Condition, Thread
+
+
+class QueueFullError(Exception):
+    '''Raised when a job is submitted to a full queue.'''
+
+
+class JobExecutor():
+    '''Runs jobs on a fixed number of worker threads from a bounded queue.'''
+
+    def __init__(self, max_workers, max_queue):
+        self.__max_workers = max_workers
+        self.__max_queue = max_queue
+        self.__queue = deque()
+        self.__condition = Condition()
+        self.__num_running = 0
+
+        for _ in range(max_workers):
+            Thread(target=self.__work, daemon=True).start()
+
+    def submit(self, job):
+        '''Queues job, raising QueueFullError if the queue is full.'''
+        with self.__condition:
+            if len(self.__queue) >= self.__max_queue:
+                raise QueueFullError('Job queue is full (%i jobs waiting), '
+                                     'please try again later'
+                                     % len(self.__queue))
+
+            self.__queue.append(job)
+            position = len(self.__queue)
+            self.__condition.notify()
+
+        job.set_queue_position(position)
+
+    def run(self, job):
+        '''Runs job in the calling thread, in place of an idle worker,
+        returning whether it was run: False if every worker is busy, or jobs
+        are waiting in the queue.'''
+        with self.__condition:
+            if self.__queue or self.__num_running >= self.__max_workers:
+                return False
+
+            self.__num_running += 1
+
+        try:
+            job.run()
+        finally:
+            self.__release()
+
+        return True
+
+    def get_num_queued(self):
+        '''Gets number of jobs waiting in the queue.'''
+        return len(self.__queue)
+
+    def get_num_running(self):
+        '''Gets number of jobs being run.'''
+        return self.__num_running
+
+    def remove(self, job):
+        '''Removes job from the queue, returning whether it was waiting.'''
+        with self.__condition:
+            if job not in self.__queue:
+                return False
+
+            self.__queue.remove(job)
+            positions = self.__get_positions()
+
+        job.set_dequeued()
+        _report_positions(positions)
+        return True
+
+    def __work(self):
+        '''Worker loop: takes jobs from the queue and runs them.'''
+        while True:
+            with self.__condition:
+                # Jobs run in callers' threads take the place of workers:
+                self.__condition.wait_for(
+                    lambda: self.__queue and
+                    self.__num_running < self.__max_workers)
+                job = self.__queue.popleft()
+                positions = self.__get_positions()
+                self.__num_running += 1
+
+            job.set_dequeued()
+            _report_positions(positions)
+
+            try:
+                job.run()
+            finally:
+                self.__release()
+
+    def __release(self):
+        '''Frees the place of a job that has been run.'''
+        with self.__condition:
+            self.__num_running -= 1
+            self.__condition.notify()
+
+    def __get_positions(self):
+        '''Gets queue positions of those still waiting.'''
+        return list(enumerate(self.__queue, 1))
+
+
+def _report_positions(positions):
+    '''Reports queue positions to those still waiting.'''
+    for position, waiting in positions:
+        waiting.set_queue_position(position)
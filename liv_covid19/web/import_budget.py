@@ -0,0 +1,88 @@
+'''
+(c) University of Liverpool 2020
+
+Licensed under the MIT License.
+
+To view a copy of this license, visit <http://opensource.org/licenses/MIT/>..
+
+@author: neilswainston
+'''
+import subprocess
+import sys
+
+
+# Cumulative import time budgets, in milliseconds, of the web layer:
+BUDGETS = {'main': 400,
+           'flask': 250,
+           'liv_covid19.web.manager': 40,
+           'liv_covid19.web.job': 15,
+           'liv_covid19.web.batch': 15,
+           'liv_covid19.web.cache': 5,
+           'liv_covid19.web.executor': 5,
+           'liv_covid19.web.metrics': 5,
+           'liv_covid19.web.progress': 5,
+           'liv_covid19.web.store': 15,
+           'liv_covid19.web.artic.normal_thread': 10,
+           'liv_covid19.web.artic.opentrons_thread': 10}
+
+# Modules only to be imported once a job is run:
+DEFERRED = ['numpy', 'pandas', 'opentrons']
+
+
+def get_import_times(module='main', repeats=5):
+    '''Gets the best, over repeats, cumulative import time (in ms) of each
+    module imported in a fresh interpreter importing module.'''
+    times = {}
+
+    for _ in range(repeats):
+        proc = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                               'import ' + module],
+                              stderr=subprocess.PIPE,
+                              universal_newlines=True,
+                              check=True)
+
+        for line in proc.stderr.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+
+            _, cumulative, name = line[len('import time:'):].split('|')
+            name = name.strip()
+            cumulative = int(cumulative) / 1000.0
+            times[name] = min(times.get(name, cumulative), cumulative)
+
+    return times
+
+
+def check(times):
+    '''Checks import times against budgets, returning list of failures.'''
+    failures = ['%s: %.1fms over budget of %ims' % (name, times[name],
+                                                    budget)
+                for name, budget in BUDGETS.items()
+                if times.get(name, 0) > budget]
+
+    failures.extend(['%s: imported at start up' % name
+                     for name in DEFERRED if name in times])
+
+    return failures
+
+
+def main(args):
+    '''main method: reports import times of args[0] (default main), per
+    module, and exits non-zero if any budget is exceeded.'''
+    times = get_import_times(*args[:1])
+
+    for name in sorted(times):
+        if name in BUDGETS or name.startswith('liv_covid19'):
+            print('%-45s %8.1fms %8s' % (name, times[name],
+                                         BUDGETS.get(name, '')))
+
+    failures = check(times)
+
+    for failure in failures:
+        print('FAIL ' + failure)
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
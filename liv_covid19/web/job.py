@@ -7,35 +7,114 @@ To view a copy of this license, visit <http://opensource.org/licenses/MIT/>..
 
 @author: neilswainston
 '''
+# pylint: disable=import-outside-toplevel
 # pylint: disable=invalid-name
-import os
-from threading import Thread
+from collections import OrderedDict
+import functools
+import hashlib
+import io
+import json
+import tempfile
+from threading import Lock
+import time
 import uuid
 import zipfile
 
+from liv_covid19.web import progress
 
-class JobThread(Thread):
-    '''Wraps a job into a thread, and fires events.'''
 
-    def __init__(self, query, max_iter):
-        Thread.__init__(self)
+# Statuses of a job that has ended:
+END_STATUSES = ('finished', 'error', 'cancelled')
 
+# Folder of result bundle holding profile data, of profiled jobs:
+PROFILE_DIR = 'profile/'
+
+# Folder of result bundle holding simulation results, of validated jobs:
+VALIDATION_DIR = 'validation/'
+
+# Size, in bytes, above which uploads are spooled to disk:
+SPOOL_MAX_SIZE = 8 * 1024 ** 2
+
+
+class JobThread():
+    '''Wraps a job, run (by calling run) in a worker thread of the job
+    executor, and fires events.'''
+
+    def __init__(self, query, max_iter, validates=False):
         self._job_id = str(uuid.uuid4())
         self._query = query
         self._result = None
+        self._bundle = None
         self._cancelled = False
+        self._iteration = 0
 
-        self.__max_iter = max_iter
+        # Optionally validate protocol scripts by simulation, in an extra
+        # stage (of jobs that generate them):
+        self.__validate = validates and \
+            str(query.get('validate')).lower() in ['true', '1']
+        self.__simulator = None
+        self.__validation = None
+
+        self.__max_iter = max_iter + (1 if self.__validate else 0)
+        self.__submitted = time.time()
+        self.__timings = OrderedDict()
+        self.__progress = progress.Progress(self.__stage_fired,
+                                            self._is_cancelled)
         self.__listeners = set()
+        self.__pool = None
+        self.__future = None
+        self.__cancel_event = None
+        self.__cancel_requested = None
+        self.__queue_lock = Lock()
+        self.__dequeued = False
+
+        # Optionally profile job function:
+        self.__profile = str(query.get('profile')).lower() in ['true', '1']
+        self.__profile_files = {}
 
     def get_job_id(self):
         '''Gets thread job id.'''
         return self._job_id
 
+    def get_app(self):
+        '''Gets app of job.'''
+        return self._query.get('app', 'undefined')
+
+    def get_elapsed(self):
+        '''Gets time elapsed since the job was submitted.'''
+        return time.time() - self.__submitted
+
+    def get_bundle(self):
+        '''Gets result bundle.'''
+        return self._bundle
+
+    def release_bundle(self):
+        '''Releases result bundle, once exported elsewhere.'''
+        self._bundle = None
+
+    def set_pool(self, pool):
+        '''Sets process pool in which to run the job function.'''
+        self.__pool = pool
+
+    def set_cancel_requested(self, cancel_requested):
+        '''Sets function checking whether cancellation of the job has been
+        requested elsewhere (by another server process).'''
+        self.__cancel_requested = cancel_requested
+
+    def set_simulator(self, simulator):
+        '''Sets simulator with which to validate protocol scripts.'''
+        self.__simulator = simulator
+
     def cancel(self):
         '''Cancels the current job.'''
         self._cancelled = True
 
+        if self.__cancel_event:
+            self.__cancel_event.set()
+
+        if self.__future:
+            self.__future.cancel()
+
     def add_listener(self, listener):
         '''Adds an event listener.'''
         self.__listeners.add(listener)
@@ -44,7 +123,126 @@ class JobThread(Thread):
         '''Removes an event listener.'''
         self.__listeners.remove(listener)
 
-    def _fire_job_event(self, status, iteration, message=''):
+    def set_queue_position(self, position):
+        '''Sets position in job queue while waiting to run (ignored once
+        taken from the queue).'''
+        with self.__queue_lock:
+            if not self.__dequeued:
+                self._fire_job_event('queued', 0,
+                                     'Queued (position %i)...' % position,
+                                     queue_position=position)
+
+    def set_dequeued(self):
+        '''Marks job as taken from the queue, once any queue position being
+        reported has been, so that none is reported after it starts.'''
+        with self.__queue_lock:
+            self.__dequeued = True
+
+    def _call(self, func, **kwargs):
+        '''Calls job function, passing it a progress reporter, in the process
+        pool (if set).'''
+        if self.__profile:
+            from liv_covid19.web import profiler
+
+            # tracemalloc traces (and slows) the whole process, so only
+            # traces jobs run alone, in a worker process:
+            result, self.__profile_files = self.__call(
+                functools.partial(profiler.run, func,
+                                  trace_memory=bool(self.__pool)),
+                **kwargs)
+            return result
+
+        return self.__call(func, **kwargs)
+
+    def _add_profile(self, bundle):
+        '''Adds profile data, of profiled jobs, to result bundle.'''
+        for name, data in self.__profile_files.items():
+            bundle.add(PROFILE_DIR + name, data)
+
+    def _validate(self, scripts):
+        '''Validates protocol scripts, from dict of names and content, by
+        simulation, if the query has a true 'validate' flag.'''
+        if not self.__validate:
+            return
+
+        if not self.__simulator:
+            raise ValueError('Validation is not enabled on this server')
+
+        with self._stage('validate'):
+            self.__validation = self.__simulator.validate(scripts,
+                                                          self._checkpoint)
+
+    def _add_validation(self, bundle):
+        '''Adds simulation results, of validated jobs, to result bundle: a
+        summary of each script's result, and its runlog.'''
+        if not self.__validation:
+            return
+
+        summary = OrderedDict()
+
+        for name, result in self.__validation.items():
+            summary[name] = {key: value for key, value in result.items()
+                             if key != 'runlog'}
+            bundle.add(VALIDATION_DIR + name + '.log',
+                       result['runlog'].encode())
+
+        bundle.add(VALIDATION_DIR + 'summary.json',
+                   json.dumps(summary, indent=2, sort_keys=True).encode())
+
+    def __call(self, func, **kwargs):
+        '''Calls function, in the process pool if one is set.'''
+        if not self.__pool:
+            return func(progress=self.__progress, **kwargs)
+
+        # Spooled inputs cannot be passed to worker processes, so are read
+        # only now, as the job runs:
+        kwargs = {key: value.read() if hasattr(value, 'read') else value
+                  for key, value in kwargs.items()}
+
+        queue = self.__pool.get_queue()
+        self.__cancel_event = self.__pool.get_event()
+
+        if self._cancelled:
+            self.__cancel_event.set()
+
+        self.__future = self.__pool.submit(progress.call, func, queue,
+                                           self.__cancel_event, kwargs)
+
+        # Stage reports are queued before the call returns, so end them with
+        # a sentinel once the call is done (or cancelled):
+        self.__future.add_done_callback(lambda _: queue.put(None))
+
+        if self._cancelled:
+            self.__future.cancel()
+
+        for msg in iter(queue.get, None):
+            self.__stage_fired(*msg)
+
+            # Pass on cancellation requested elsewhere to the worker:
+            self._is_cancelled()
+
+        return self.__future.result()
+
+    def _is_cancelled(self):
+        '''Checks whether the job has been cancelled, cancelling it if
+        requested elsewhere.'''
+        if not self._cancelled and self.__cancel_requested and \
+                self.__cancel_requested():
+            self.cancel()
+
+        return self._cancelled
+
+    def _checkpoint(self):
+        '''Cancellation checkpoint: raises CancelledError if the job has been
+        cancelled.'''
+        self.__progress.check()
+
+    def _stage(self, name):
+        '''Context manager timing a stage run within this thread.'''
+        return self.__progress.stage(name)
+
+    def _fire_job_event(self, status, iteration, message='',
+                        queue_position=None, stage=None, duration=None):
         '''Fires an event.'''
         event = {'update': {'status': status,
                             'message': message,
@@ -54,8 +252,18 @@ class JobThread(Thread):
                             'max_iter': self.__max_iter}
                  }
 
+        if queue_position is not None:
+            event['update']['queue_position'] = queue_position
+
+        if stage is not None:
+            event['update']['stage'] = stage
+
+        if duration is not None:
+            event['update']['duration'] = duration
+
         if status == 'finished':
             event['result'] = self._result
+            event['timings'] = self.__timings
 
         self._fire_event(event)
 
@@ -66,15 +274,125 @@ class JobThread(Thread):
         for listener in self.__listeners:
             listener.event_fired(event)
 
+    def __stage_fired(self, stage, duration):
+        '''Fires event on the start, or end, of a stage.'''
+        if duration is None:
+            self._fire_job_event('running', self._iteration,
+                                 'Running: %s...' % stage, stage=stage)
+        else:
+            self.__timings[stage] = duration
+            self._iteration += 1
+            self._fire_job_event('running', self._iteration,
+                                 'Completed: %s' % stage, stage=stage,
+                                 duration=duration)
+
+
+def read_input(src, chunk_size=1024 * 1024, max_size=SPOOL_MAX_SIZE):
+    '''Spools uploaded file stream in chunks, in memory up to max_size and
+    to disk beyond it, returning the (rewound) spooled file and its
+    digest.'''
+    digest = hashlib.sha256()
+    out = tempfile.SpooledTemporaryFile(max_size)
+
+    for chunk in iter(lambda: src.read(chunk_size), b''):
+        out.write(chunk)
+        digest.update(chunk)
+
+    out.seek(0)
+    return out, digest.hexdigest()
+
+
+class ResultBundle():
+    '''In-memory bundle of result files, zipped on demand.'''
+
+    def __init__(self):
+        self.__files = OrderedDict()
+
+        # Files are zipped with the bundle's creation time, so that zipping a
+        # bundle again gives identical bytes:
+        self.__date_time = time.localtime()[:6]
+
+    def add(self, name, data):
+        '''Adds file.'''
+        self.__files[name] = data
+
+    def add_files(self, files, checkpoint=None):
+        '''Adds files from dict of names and content, calling checkpoint (if
+        any) before each.'''
+        for name, data in files.items():
+            if checkpoint:
+                checkpoint()
+
+            self.add(name, data)
+
+    def add_bundle(self, bundle, prefix=''):
+        '''Adds all files within another bundle.'''
+        for name, data in bundle.get_files():
+            self.add(prefix + name, data)
+
+    def add_zip(self, filename):
+        '''Adds all files within zip file.'''
+        with zipfile.ZipFile(filename) as zf:
+            for name in zf.namelist():
+                self.add(name, zf.read(name))
+
+    def get_files(self):
+        '''Gets (name, data) of files.'''
+        return list(self.__files.items())
+
+    def get_size(self):
+        '''Gets total (uncompressed) size.'''
+        return sum(len(data) for data in self.__files.values())
+
+    def get_digest(self):
+        '''Gets SHA-256 hex digest of file names and content.'''
+        sha = hashlib.sha256()
+
+        for name, data in self.__files.items():
+            sha.update(name.encode())
+            sha.update(b'\0%i\0' % len(data))
+            sha.update(data)
+
+        return sha.hexdigest()
+
+    def stream(self, compresslevel=6):
+        '''Zips files on the fly, yielding chunks of the zip.'''
+        out = _ChunkWriter()
+
+        with zipfile.ZipFile(out, 'w', compression=zipfile.ZIP_DEFLATED,
+                             compresslevel=compresslevel) as zf:
+            for name, data in self.__files.items():
+                info = zipfile.ZipInfo(name, self.__date_time)
+                info.compress_type = zipfile.ZIP_DEFLATED
+                info.external_attr = 0o644 << 16
+                zf.writestr(info, data, compresslevel=compresslevel)
+                yield out.pop()
+
+        yield out.pop()
+
+    def write(self, filename, compresslevel=6):
+        '''Writes zip file.'''
+        with open(filename, 'wb') as fle:
+            for chunk in self.stream(compresslevel):
+                fle.write(chunk)
+
+
+class _ChunkWriter(io.RawIOBase):
+    '''Unseekable stream, buffering written chunks until popped.'''
+
+    def __init__(self):
+        io.RawIOBase.__init__(self)
+        self.__chunks = []
 
-def save_export(parent_dir, out_dir, job_id):
-    '''Save export file, returning the url.'''
-    out_filename = os.path.join(out_dir, job_id + '.zip')
+    def writable(self):
+        return True
 
-    with zipfile.ZipFile(out_filename, 'w') as zf:
-        for path, _, filenames in os.walk(parent_dir):
-            for filename in filenames:
-                zf.write(os.path.join(path, filename),
-                         os.path.join(path.replace(parent_dir, ''), filename))
+    def write(self, data):
+        self.__chunks.append(bytes(data))
+        return len(data)
 
-    return out_filename
+    def pop(self):
+        '''Pops buffered chunks.'''
+        data = b''.join(self.__chunks)
+        self.__chunks = []
+        return data
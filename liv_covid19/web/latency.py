@@ -0,0 +1,84 @@
+'''
+(c) University of Liverpool 2020
+
+Licensed under the MIT License.
+
+To view a copy of this license, visit <http://opensource.org/licenses/MIT/>..
+
+@author: neilswainston
+'''
+import json
+import sys
+import tempfile
+import time
+
+from liv_covid19.web.manager import Manager
+
+
+# End-to-end latency target, in seconds, of small synchronous jobs (95th
+# percentile, from submission to zipped result):
+SYNC_TARGET = 0.1
+
+
+def measure(manager, data, wait, repeats):
+    '''Measures end-to-end latencies, from submission to zipped result, of
+    repeated submissions of data.'''
+    latencies = []
+
+    for _ in range(repeats):
+        start = time.time()
+        job_id = manager.submit(data, wait)
+
+        if not wait:
+            # Asynchronous path: follow progress stream until job ends:
+            for _ in manager.get_progress(job_id):
+                pass
+
+        b''.join(manager.get_bundle(job_id).stream())
+        latencies.append(time.time() - start)
+
+    return sorted(latencies)
+
+
+def main(args):
+    '''main method: measures latency of args[1] (default 20) Normalise jobs
+    on plate reader file args[0], synchronously and asynchronously, and
+    exits non-zero if the synchronous target is missed.'''
+    repeats = int(args[1]) if len(args) > 1 else 20
+
+    with open(args[0], encoding='utf-8-sig') as fle:
+        content = fle.read()
+
+    manager = Manager(tempfile.gettempdir(), result_mode='memory',
+                      cache_size=0)
+
+    data = json.dumps({'app': 'Normalise',
+                       'file_name': 'plate.csv',
+                       'file_content': content,
+                       'target_mass': 50.0,
+                       'temp_deck': 'tempdeck',
+                       'vol_scale': 1.0})
+
+    # Warm up imports, and first use of the numeric stack:
+    manager.warmup()
+    measure(manager, data, 10, 1)
+
+    results = {}
+
+    for name, wait in [('async', 0), ('sync', 10)]:
+        latencies = measure(manager, data, wait, repeats)
+        results[name] = latencies[int(0.95 * (len(latencies) - 1))]
+
+        print('%-5s p50 %.1fms, p95 %.1fms' % (
+            name, latencies[len(latencies) // 2] * 1000,
+            results[name] * 1000))
+
+    print('sync p95 target %.1fms: %s' % (
+        SYNC_TARGET * 1000,
+        'met' if results['sync'] <= SYNC_TARGET else 'MISSED'))
+
+    sys.exit(0 if results['sync'] <= SYNC_TARGET else 1)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -7,90 +7,568 @@ To view a copy of this license, visit <http://opensource.org/licenses/MIT/>..
 
 @author: neilswainston
 '''
+# pylint: disable=import-outside-toplevel
+from collections import OrderedDict
+import importlib
+import io
 import json
 import os.path
-from threading import Thread
+from threading import Condition, RLock
 import time
+import zipfile
 
+from liv_covid19.web import batch, cache, job, metrics, store
 from liv_covid19.web.artic import normal_thread, opentrons_thread
+from liv_covid19.web.executor import JobExecutor, QueueFullError
+
+_JOB_MODULES = ['liv_covid19.web.artic.normal',
+                'liv_covid19.web.artic.opentrons']
 
 
 class Manager():
     '''Wbapp manager.'''
 
-    def __init__(self, out_dir):
+    def __init__(self, out_dir, max_workers=2, max_queue=32,
+                 use_processes=False, job_ttl=3600, max_jobs=1000,
+                 result_mode='disk', compresslevel=6, cache_size=256,
+                 job_store=None, poll_interval=0.5, max_events=256,
+                 sync_max_bytes=32768, simulators=0, sim_cache=None,
+                 sim_cache_bytes=256 * 1024 ** 2, get_thread=None):
         self.__out_dir = out_dir
-        self.__status = {}
+        self.__get_app_thread = get_thread or _get_thread
+        self.__sync_max_bytes = sync_max_bytes
+        self.__store = job_store or \
+            store.MemoryJobStore(max_events=max_events)
+        self.__poll_interval = poll_interval
+        self.__result_mode = result_mode
+        self.__compresslevel = compresslevel
+        self.__job_ttl = job_ttl
+        self.__max_jobs = max_jobs
+
+        # Optionally run job functions in a pool of processes, one per
+        # worker thread, so that they are not serialised by the GIL:
+        self.__pool = None
+
+        if use_processes:
+            from liv_covid19.web.process_pool import ProcessPool
+            self.__pool = ProcessPool(max_workers, _JOB_MODULES)
+
+        # Optionally validate protocol scripts of jobs (on request), in a
+        # pool of simulator processes, caching results on disk:
+        self.__simulator = None
+
+        if simulators:
+            from liv_covid19.web.artic import simulator
+            self.__simulator = simulator.Simulator(
+                simulators,
+                cache=simulator.SimulationCache(sim_cache, sim_cache_bytes)
+                if sim_cache else None)
+
+        self.__executor = JobExecutor(max_workers, max_queue)
+        self.__metrics = self.__get_metrics()
+
+        # Threads and event notification of jobs run by this process:
         self.__threads = {}
-        self.__writers = {}
+        self.__conditions = {}
+        self.__last_event_ids = {}
+        self.__ended = OrderedDict()
+        self.__progress_listeners = []
+        self.__cache = cache.ResultCache(cache_size) if cache_size else None
+        self.__cache_keys = {}
+        self.__batches = []
+        self.__lock = RLock()
 
         if not os.path.exists(self.__out_dir):
             os.makedirs(self.__out_dir)
 
-    def submit(self, data):
-        '''Responds to submission.'''
+    def warmup(self):
+        '''Imports job modules, and warms the process pool and simulator
+        (if any), ahead of the first job.'''
+        for module in _JOB_MODULES:
+            importlib.import_module(module)
+
+        if self.__pool:
+            self.__pool.warm()
+
+        if self.__simulator:
+            self.__simulator.warm()
+
+    def submit(self, data, wait=0):
+        '''Responds to submission, waiting up to wait seconds (if given) for
+        the job to end.'''
         query = json.loads(data)
+        file_content = query.pop('file_content').encode()
 
-        # Do job in new thread, return result when completed:
-        thread = self.__get_thread(query)
-        job_id = thread.get_job_id()
-        thread.add_listener(self)
-        self.__threads[job_id] = thread
+        # Spool content, as uploads are, so that it is released once parsed:
+        content, digest = job.read_input(io.BytesIO(file_content))
+
+        # Run small jobs inline, in place of an idle worker:
+        job_id = self.__submit_input(
+            query, content, digest,
+            inline=wait and len(file_content) <= self.__sync_max_bytes)
+
+        if wait:
+            self.__wait(job_id, wait)
 
-        # Start new Threads:
-        thread_pool = ThreadPool(thread)
-        thread_pool.start()
+        return job_id
+
+    def submit_file(self, query, src, listener=None):
+        '''Responds to submission of streamed file.'''
+        content, digest = job.read_input(src)
+        return self.__submit_input(query, content, digest, listener)
+
+    def submit_batch(self, query, files):
+        '''Responds to submission of a batch of (file name, streamed file),
+        one per plate.'''
+        if not files:
+            raise ValueError('No files submitted')
+
+        batch_job = batch.BatchJob(query, len(files),
+                                   self.__get_result_bundle, self.cancel,
+                                   self.__submit_input)
+
+        for file_name, src in files:
+            batch_job.add_plate(file_name, dict(query, file_name=file_name),
+                                *job.read_input(src))
+
+        job_id = batch_job.get_job_id()
+        batch_job.add_listener(self)
+        self.__register(batch_job)
+        self.__metrics.inc('jobs_submitted_total', {'app': 'Batch'})
+        batch_job.set_running()
+
+        with self.__lock:
+            self.__batches.append(batch_job)
 
+        self.__feed_batches()
         return job_id
 
-    def get_progress(self, job_id):
-        '''Returns progress of job.'''
+    def get_progress(self, job_id, last_event_id=0):
+        '''Returns progress of job, resuming after last_event_id (from the
+        Last-Event-ID header of a reconnecting client).'''
         def _check_progress(job_id):
-            '''Checks job progress.'''
-            while (job_id not in self.__status or
-                    self.__status[job_id]['update']['status'] == 'running'):
-                time.sleep(1)
+            '''Streams job events, as SSE frames, as they are fired.'''
+            with self.__lock:
+                self.__prune()
+                condition = self.__conditions.get(job_id)
 
-                if job_id in self.__status:
-                    yield 'data:' + self.__get_response(job_id) + '\n\n'
+            idx = last_event_id
 
-            yield 'data:' + self.__get_response(job_id) + '\n\n'
+            while True:
+                for event_id, frame, end in self.get_frames(job_id, idx):
+                    yield frame
+
+                    if end:
+                        return
+
+                    idx = event_id
+
+                if condition:
+                    # Block (without polling) until new events are fired:
+                    with condition:
+                        condition.wait_for(
+                            lambda: self.__last_event_ids.get(job_id,
+                                                              idx + 1) > idx)
+                else:
+                    # Job run by another process, so poll shared store:
+                    time.sleep(self.__poll_interval)
 
         return _check_progress(job_id)
 
+    def is_local(self, job_id):
+        '''Checks whether job is run by this process, so that its events are
+        pushed to progress listeners as they are fired.'''
+        with self.__lock:
+            return job_id in self.__conditions
+
+    def get_poll_interval(self):
+        '''Gets interval, in seconds, at which to poll the job store for
+        events of jobs run by other processes.'''
+        return self.__poll_interval
+
+    def get_events(self, job_id, after=0):
+        '''Gets (event id, event) of job events after event id.'''
+        status, summary = self.__store.get_status(job_id)
+
+        if status in [None, 'expired']:
+            return [(None, _get_missing_event(job_id, summary))]
+
+        return self.__store.get_events(job_id, after)
+
+    def get_frames(self, job_id, after=0):
+        '''Gets (event id, SSE frame, whether job's end event) of job events
+        after event id.'''
+        status, summary = self.__store.get_status(job_id)
+
+        if status in [None, 'expired']:
+            return [(None, store.get_frame(None, json.dumps(
+                _get_missing_event(job_id, summary))), True)]
+
+        frames = self.__store.get_frames(job_id, after)
+
+        if not frames and status in job.END_STATUSES:
+            frames = self.__store.get_frames(job_id)[-1:]
+
+        return frames
+
+    def add_progress_listener(self, listener):
+        '''Adds listener, passed (job id, event id, SSE frame, whether job's
+        end event) of every job event.'''
+        self.__progress_listeners.append(listener)
+
+    def get_result_filename(self, job_id):
+        '''Gets filename of job result on disk, or None.'''
+        return self.__store.get_result(job_id)
+
+    def get_status(self, job_id):
+        '''Gets status of job, or None if unknown.'''
+        return self.__store.get_status(job_id)[0]
+
+    def get_result_etag(self, job_id):
+        '''Gets entity tag of job result, or None.'''
+        status, event = self.__store.get_status(job_id)
+        return event.get('etag') if status == 'finished' else None
+
+    def get_bundle(self, job_id):
+        '''Gets in-memory result bundle of job, if any.'''
+        thread = self.__threads.get(job_id)
+        return thread.get_bundle() if thread else None
+
+    def get_profile(self, job_id):
+        '''Gets profile summary of finished, profiled job, or None.'''
+        name = job.PROFILE_DIR + 'summary.txt'
+        bundle = self.get_bundle(job_id)
+
+        if bundle:
+            return dict(bundle.get_files()).get(name)
+
+        result_filename = self.get_result_filename(job_id)
+
+        if result_filename and os.path.exists(result_filename):
+            with zipfile.ZipFile(result_filename) as zfile:
+                if name in zfile.namelist():
+                    return zfile.read(name)
+
+        return None
+
+    def get_metrics(self):
+        '''Gets metrics of this process.'''
+        return self.__metrics
+
+    def get_cache_stats(self):
+        '''Gets result cache statistics, and those of the simulation cache (if
+        any).'''
+        stats = self.__cache.get_stats() if self.__cache else {}
+
+        if self.__simulator:
+            stats['simulations'] = self.__simulator.get_cache_stats()
+
+        return stats
+
     def cancel(self, job_id):
         '''Cancels job.'''
-        self.__threads[job_id].cancel()
+        thread = self.__threads.get(job_id)
+
+        if thread:
+            thread.cancel()
+
+            if self.__executor.remove(thread):
+                thread.run()
+        elif self.__store.get_status(job_id)[0] not in \
+                (None, 'expired') + job.END_STATUSES:
+            self.__store.request_cancel(job_id)
+
         return job_id
 
     def event_fired(self, event):
         '''Responds to event being fired.'''
-        self.__status[event['job_id']] = event
+        job_id = event['job_id']
+        self.__update_metrics(event)
+
+        if event['update']['status'] == 'finished':
+            # Results are immutable, so tag them by content and compression:
+            event['etag'] = '%s-%i' % (
+                self.__threads[job_id].get_bundle().get_digest(),
+                self.__compresslevel)
+
+        if event['update']['status'] == 'finished' and \
+                self.__result_mode == 'disk':
+            # Write result to disk before reporting job as finished:
+            thread = self.__threads[job_id]
+            result_filename = os.path.join(self.__out_dir, job_id + '.zip')
+            thread.get_bundle().write(result_filename, self.__compresslevel)
+            thread.release_bundle()
+            self.__store.set_result(job_id, result_filename)
+
+        event_id, frame = self.__store.add_event(job_id, event)
+
+        with self.__conditions[job_id]:
+            self.__last_event_ids[job_id] = event_id
+            self.__conditions[job_id].notify_all()
 
-    def __get_response(self, job_id):
-        '''Returns current progress for job id.'''
-        return json.dumps(self.__status[job_id])
+        for listener in self.__progress_listeners:
+            listener.progress_fired(job_id, event_id, frame,
+                                    is_end_event(event))
 
-    def __get_thread(self, query):
+        if event['update']['status'] in job.END_STATUSES:
+            with self.__lock:
+                self.__ended[job_id] = time.time()
+                key = self.__cache_keys.pop(job_id, None)
+
+                if key and event['update']['status'] == 'finished':
+                    self.__cache.put(key, job_id)
+
+                self.__prune()
+
+        # Queue capacity may have been freed (except by queue moves, fired
+        # while the queue is locked):
+        if event['update']['status'] != 'queued':
+            self.__feed_batches()
+
+    def __submit_input(self, query, content, digest, listener=None,
+                       inline=False):
+        '''Submits (or runs inline) job on spooled file content, unless an
+        identical query has been run.'''
+        key = None
+
+        if self.__cache:
+            # Return completed job if an identical query has been run:
+            key = cache.get_key(query, digest)
+            job_id = self.__get_cached(key)
+
+            if job_id:
+                content.close()
+
+                if listener:
+                    listener.event_fired(self.__store.get_status(job_id)[1])
+
+                return job_id
+
+        if inline:
+            return self.__run_inline(query, content, key)
+
+        return self.__submit(query, content, key, listener)
+
+    def __feed_batches(self):
+        '''Feeds pending plates of batches into the job queue.'''
+        with self.__lock:
+            batches = list(self.__batches)
+
+        for batch_job in batches:
+            if batch_job.feed():
+                with self.__lock:
+                    if batch_job in self.__batches:
+                        self.__batches.remove(batch_job)
+
+    def __submit(self, query, content, key, listener=None):
+        '''Submits job on input file content.'''
+        thread = self.__get_thread(query, content)
+
+        job_id = thread.get_job_id()
+        thread.add_listener(self)
+
+        if listener:
+            thread.add_listener(listener)
+
+        self.__register(thread, key)
+        self.__metrics.inc('jobs_submitted_total', {'app': thread.get_app()})
+        self.__enqueue(thread)
+        return job_id
+
+    def __run_inline(self, query, content, key):
+        '''Runs job in the calling thread, bypassing queue and process pool,
+        in place of an idle worker, or else queues it.'''
+        thread = self.__get_thread(query, content)
+        thread.set_pool(None)
+        thread.add_listener(self)
+        self.__register(thread, key)
+        self.__metrics.inc('jobs_submitted_total', {'app': thread.get_app()})
+
+        if not self.__executor.run(thread):
+            thread.set_pool(self.__pool)
+            self.__enqueue(thread)
+
+        return thread.get_job_id()
+
+    def __enqueue(self, thread):
+        '''Queues registered job, forgetting it if the queue is full.'''
+        try:
+            self.__executor.submit(thread)
+        except QueueFullError:
+            self.__unregister(thread.get_job_id())
+            raise
+
+    def __wait(self, job_id, timeout):
+        '''Waits, for up to timeout, for job run by this process to end.'''
+        condition = self.__conditions.get(job_id)
+
+        if condition:
+            with condition:
+                condition.wait_for(
+                    lambda: self.get_status(job_id) in job.END_STATUSES,
+                    timeout)
+
+    def __register(self, thread, key=None):
+        '''Registers job.'''
+        job_id = thread.get_job_id()
+        thread.set_cancel_requested(
+            lambda: self.__store.is_cancel_requested(job_id))
+
+        with self.__lock:
+            self.__prune()
+            self.__store.add_job(job_id)
+            self.__threads[job_id] = thread
+            self.__conditions[job_id] = Condition()
+            self.__last_event_ids[job_id] = 0
+
+            if key:
+                self.__cache_keys[job_id] = key
+
+    def __unregister(self, job_id):
+        '''Unregisters job that could not be submitted.'''
+        with self.__lock:
+            self.__store.remove_job(job_id)
+            del self.__threads[job_id]
+            del self.__conditions[job_id]
+            del self.__last_event_ids[job_id]
+            self.__cache_keys.pop(job_id, None)
+
+    def __get_result_bundle(self, job_id):
+        '''Gets result bundle of finished job, from memory or disk.'''
+        bundle = self.__threads[job_id].get_bundle()
+
+        if bundle is None:
+            bundle = job.ResultBundle()
+            bundle.add_zip(os.path.join(self.__out_dir, job_id + '.zip'))
+
+        return bundle
+
+    def __get_cached(self, key):
+        '''Gets cached job id for key, refreshing its eviction time.'''
+        with self.__lock:
+            job_id = self.__cache.get(key)
+
+            if job_id and self.__store.get_status(job_id)[0] != 'finished':
+                # Expired by another process:
+                self.__cache.remove_job(job_id)
+                job_id = None
+
+            if job_id:
+                self.__store.touch(job_id)
+
+                if job_id in self.__ended:
+                    self.__ended[job_id] = time.time()
+                    self.__ended.move_to_end(job_id)
+
+            return job_id
+
+    def __prune(self):
+        '''Evicts ended jobs older than the TTL, or beyond the maximum
+        number of jobs.'''
+        expiry = time.time() - self.__job_ttl
+
+        for job_id in self.__store.prune(expiry, self.__max_jobs):
+            self.__evict(job_id)
+
+            result_filename = os.path.join(self.__out_dir, job_id + '.zip')
+
+            if os.path.exists(result_filename):
+                os.remove(result_filename)
+
+        # Evict threads of jobs expired by other processes:
+        while self.__ended and next(iter(self.__ended.values())) < expiry:
+            self.__evict(next(iter(self.__ended)))
+
+    def __evict(self, job_id):
+        '''Evicts job run by this process, if any.'''
+        if self.__cache:
+            self.__cache.remove_job(job_id)
+
+        if job_id in self.__threads:
+            self.__ended.pop(job_id, None)
+            del self.__threads[job_id]
+            del self.__conditions[job_id]
+            del self.__last_event_ids[job_id]
+
+    def __get_metrics(self):
+        '''Gets metrics, fed by the events of jobs.'''
+        mtrcs = metrics.Metrics('liv_covid19_')
+        mtrcs.add_counter('jobs_submitted_total', 'Jobs submitted, by app.')
+        mtrcs.add_counter('jobs_ended_total',
+                          'Jobs ended, by app and end status.')
+        mtrcs.add_gauge('jobs_running', 'Jobs being run.',
+                        self.__executor.get_num_running)
+        mtrcs.add_gauge('jobs_queued', 'Jobs waiting in the queue.',
+                        self.__executor.get_num_queued)
+        mtrcs.add_histogram('job_duration_seconds',
+                            'Time from submission to end of jobs, by app '
+                            'and end status.')
+        mtrcs.add_histogram('stage_duration_seconds',
+                            'Duration of job stages, by app and stage.')
+        mtrcs.add_histogram('result_bundle_bytes',
+                            'Uncompressed size of result bundles, by app.',
+                            metrics.SIZE_BUCKETS)
+        mtrcs.add_histogram('http_request_duration_seconds',
+                            'Time to respond to requests, by route, method '
+                            'and status code.')
+        return mtrcs
+
+    def __update_metrics(self, event):
+        '''Updates metrics from job event.'''
+        thread = self.__threads[event['job_id']]
+        update = event['update']
+        app = thread.get_app()
+
+        if 'duration' in update:
+            self.__metrics.observe('stage_duration_seconds',
+                                   update['duration'],
+                                   {'app': app, 'stage': update['stage']})
+
+        if update['status'] in job.END_STATUSES:
+            labels = {'app': app, 'status': update['status']}
+            self.__metrics.inc('jobs_ended_total', labels)
+            self.__metrics.observe('job_duration_seconds',
+                                   thread.get_elapsed(), labels)
+
+        if update['status'] == 'finished':
+            self.__metrics.observe('result_bundle_bytes',
+                                   thread.get_bundle().get_size(),
+                                   {'app': app})
+
+    def __get_thread(self, query, content):
         '''Get thread.'''
-        app = query.get('app', 'undefined')
+        thread = self.__get_app_thread(query, content)
+        thread.set_pool(self.__pool)
+        thread.set_simulator(self.__simulator)
+        return thread
+
+
+def _get_thread(query, content):
+    '''Gets thread of the query's app.'''
+    app = query.get('app', 'undefined')
+
+    if app == 'Opentrons':
+        return opentrons_thread.OpentronsThread(query, content)
 
-        if app == 'Opentrons':
-            return opentrons_thread.OpentronsThread(query, self.__out_dir)
+    if app == 'Normalise':
+        return normal_thread.NormaliseThread(query, content)
 
-        if app == 'Normalise':
-            return normal_thread.NormaliseThread(query, self.__out_dir)
+    raise ValueError('Unknown app: ' + app)
 
-        raise ValueError('Unknown app: ' + app)
 
+def is_end_event(event):
+    '''Checks whether event is the last of its job.'''
+    return event['update']['status'] in job.END_STATUSES + ('expired',)
 
-class ThreadPool(Thread):
-    '''Basic class to run job Threads sequentially.'''
 
-    def __init__(self, thread):
-        self.__thread = thread
-        Thread.__init__(self)
+def _get_missing_event(job_id, summary):
+    '''Gets event for unknown or expired job.'''
+    if summary:
+        update = {'status': 'expired',
+                  'message': 'Job expired (%s)' % summary,
+                  'expired_status': summary}
+    else:
+        update = {'status': 'error',
+                  'message': 'Unknown job: ' + job_id}
 
-    def run(self):
-        self.__thread.start()
-        self.__thread.join()
+    return {'job_id': job_id, 'update': update}
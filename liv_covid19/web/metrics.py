@@ -0,0 +1,148 @@
+'''
+(c) University of Liverpool 2020
+
+Licensed under the MIT License.
+
+To view a copy of this license, visit <http://opensource.org/licenses/MIT/>..
+
+@author: neilswainston
+'''
+from bisect import bisect_left
+from collections import OrderedDict
+from threading import RLock
+
+
+# Default histogram buckets, in seconds:
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                    10.0, 30.0, 60.0, 300.0)
+
+# Histogram buckets for sizes, in bytes:
+SIZE_BUCKETS = tuple(1024 * 4 ** exp for exp in range(10))
+
+
+class Metrics():
+    '''Registry of counters, gauges and histograms of a server process,
+    rendered in the Prometheus text exposition format.'''
+
+    def __init__(self, prefix=''):
+        self.__prefix = prefix
+        self.__metrics = OrderedDict()
+        self.__lock = RLock()
+
+    def add_counter(self, name, help_text):
+        '''Adds counter.'''
+        self.__add(name, 'counter', help_text)
+
+    def add_gauge(self, name, help_text, func):
+        '''Adds gauge, whose value is got by calling func.'''
+        self.__add(name, 'gauge', help_text, func=func)
+
+    def add_histogram(self, name, help_text, buckets=DURATION_BUCKETS):
+        '''Adds histogram.'''
+        self.__add(name, 'histogram', help_text, buckets=tuple(buckets))
+
+    def inc(self, name, labels=None, value=1):
+        '''Increments counter.'''
+        key = _get_key(labels)
+
+        with self.__lock:
+            values = self.__metrics[name]['values']
+            values[key] = values.get(key, 0) + value
+
+    def observe(self, name, value, labels=None):
+        '''Adds observation to histogram.'''
+        key = _get_key(labels)
+
+        with self.__lock:
+            metric = self.__metrics[name]
+            values = metric['values'].get(key)
+
+            if values is None:
+                values = {'buckets': [0] * len(metric['buckets']),
+                          'sum': 0.0,
+                          'count': 0}
+                metric['values'][key] = values
+
+            idx = bisect_left(metric['buckets'], value)
+
+            if idx < len(values['buckets']):
+                values['buckets'][idx] += 1
+
+            values['sum'] += value
+            values['count'] += 1
+
+    def render(self):
+        '''Renders all metrics in the Prometheus text format.'''
+        lines = []
+
+        with self.__lock:
+            for name, metric in self.__metrics.items():
+                full_name = self.__prefix + name
+                lines.append('# HELP %s %s' % (full_name, metric['help']))
+                lines.append('# TYPE %s %s' % (full_name, metric['type']))
+
+                if metric['type'] == 'gauge':
+                    lines.append('%s %s' % (full_name,
+                                            _format(metric['func']())))
+                elif metric['type'] == 'counter':
+                    for key, value in metric['values'].items():
+                        lines.append('%s%s %s' % (full_name,
+                                                  _get_labels(key),
+                                                  _format(value)))
+                else:
+                    for key, values in metric['values'].items():
+                        lines.extend(_render_histogram(full_name,
+                                                       metric['buckets'],
+                                                       key, values))
+
+        return '\n'.join(lines) + '\n'
+
+    def __add(self, name, typ, help_text, **kwargs):
+        '''Adds metric.'''
+        with self.__lock:
+            self.__metrics[name] = dict(type=typ, help=help_text,
+                                        values=OrderedDict(), **kwargs)
+
+
+def _render_histogram(name, buckets, key, values):
+    '''Renders series of histogram, with cumulative bucket counts.'''
+    lines = []
+    cumulative = 0
+
+    for bound, count in zip(buckets, values['buckets']):
+        cumulative += count
+        lines.append('%s_bucket%s %i' % (
+            name, _get_labels(key + (('le', _format(bound)),)), cumulative))
+
+    lines.append('%s_bucket%s %i' % (name,
+                                     _get_labels(key + (('le', '+Inf'),)),
+                                     values['count']))
+    lines.append('%s_sum%s %s' % (name, _get_labels(key),
+                                  _format(values['sum'])))
+    lines.append('%s_count%s %i' % (name, _get_labels(key), values['count']))
+    return lines
+
+
+def _get_key(labels):
+    '''Gets hashable key of labels.'''
+    return tuple(sorted((labels or {}).items()))
+
+
+def _get_labels(key):
+    '''Gets Prometheus label string of key.'''
+    if not key:
+        return ''
+
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape(value))
+                             for name, value in key)
+
+
+def _escape(value):
+    '''Escapes label value.'''
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+def _format(value):
+    '''Formats sample value.'''
+    return repr(float(value)) if isinstance(value, float) else str(value)
@@ -0,0 +1,67 @@
+'''
+(c) University of Liverpool 2020
+
+Licensed under the MIT License.
+
+To view a copy of this license, visit <http://opensource.org/licenses/MIT/>..
+
+@author: neilswainston
+'''
+from concurrent.futures import ProcessPoolExecutor
+import importlib
+import multiprocessing
+import os
+from threading import Lock
+
+
+class ProcessPool():
+    '''Pool of worker processes for running CPU-bound job functions.'''
+
+    def __init__(self, max_workers, modules=(), initializer=None):
+        # Server process for queues passing progress back from workers, and
+        # events passing cancellation to them, started when first needed:
+        self.__sync_manager = None
+        self.__lock = Lock()
+
+        self.__max_workers = max_workers
+        self.__executor = ProcessPoolExecutor(max_workers,
+                                              initializer=_warm,
+                                              initargs=(list(modules),
+                                                        initializer))
+
+    def warm(self):
+        '''Starts (and warms) worker processes now, rather than on first
+        job.'''
+        for future in [self.__executor.submit(os.getpid)
+                       for _ in range(self.__max_workers)]:
+            future.result()
+
+    def submit(self, func, *args, **kwargs):
+        '''Submits function call, returning a Future.'''
+        return self.__executor.submit(func, *args, **kwargs)
+
+    def get_queue(self):
+        '''Gets a queue that can be passed to worker processes.'''
+        return self.__get_sync_manager().Queue()
+
+    def get_event(self):
+        '''Gets an event that can be passed to worker processes.'''
+        return self.__get_sync_manager().Event()
+
+    def __get_sync_manager(self):
+        '''Gets server process for objects shared with workers, starting it
+        if not already.'''
+        with self.__lock:
+            if not self.__sync_manager:
+                self.__sync_manager = multiprocessing.Manager()
+
+            return self.__sync_manager
+
+
+def _warm(modules, initializer):
+    '''Imports modules, and calls initializer, in a new worker process.'''
+    for module in modules:
+        importlib.import_module(module)
+
+    if initializer:
+        initializer()
@@ -0,0 +1,96 @@
+'''
+(c) University of Liverpool 2020
+
+Licensed under the MIT License.
+
+To view a copy of this license, visit <http://opensource.org/licenses/MIT/>..
+
+@author: neilswainston
+'''
+import cProfile
+import io
+import marshal
+import pstats
+import resource
+import sys
+import time
+import tracemalloc
+
+
+def run(func, top_n=30, trace_memory=False, **kwargs):
+    '''Calls func under cProfile, and tracemalloc if trace_memory, returning
+    its result and files of profile data: profile.prof (loadable by pstats)
+    and summary.txt (top_n hotspots and memory high-water marks).'''
+    # tracemalloc traces the whole process, so is not started if already
+    # tracing (e.g. by PYTHONTRACEMALLOC):
+    owned = trace_memory and not tracemalloc.is_tracing()
+
+    if owned:
+        tracemalloc.start()
+
+    prof = cProfile.Profile()
+    start = time.time()
+
+    try:
+        prof.enable()
+
+        try:
+            result = func(**kwargs)
+        finally:
+            prof.disable()
+
+        elapsed = time.time() - start
+        peak, snapshot = None, None
+
+        if trace_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+    finally:
+        if owned:
+            tracemalloc.stop()
+
+    stats = pstats.Stats(prof, stream=io.StringIO())
+
+    files = {'profile.prof': marshal.dumps(stats.stats),
+             'summary.txt': _get_summary(stats, elapsed, peak, snapshot,
+                                         top_n).encode()}
+
+    return result, files
+
+
+def _get_summary(stats, elapsed, peak, snapshot, top_n):
+    '''Gets text summary of hotspots and memory use.'''
+    out = io.StringIO()
+    out.write('Wall-clock time: %.3fs\n' % elapsed)
+
+    if snapshot:
+        out.write('Peak traced memory: %.1f MB\n' % (peak / 1024.0 ** 2))
+
+    out.write('Process max RSS: %.1f MB\n' % _get_max_rss())
+
+    if snapshot:
+        out.write('\nTop %i allocation sites:\n' % top_n)
+
+        for stat in snapshot.statistics('lineno')[:top_n]:
+            out.write('%s\n' % stat)
+    else:
+        out.write('(Allocations traced only for jobs run in the process '
+                  'pool)\n')
+
+    stats.stream = out
+
+    out.write('\nTop %i functions by cumulative time:\n' % top_n)
+    stats.sort_stats('cumulative').print_stats(top_n)
+
+    out.write('\nTop %i functions by internal time:\n' % top_n)
+    stats.sort_stats('tottime').print_stats(top_n)
+
+    return out.getvalue()
+
+
+def _get_max_rss():
+    '''Gets maximum resident set size of this process, in MB.'''
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Reported in bytes on macOS, and in KB elsewhere:
+    return max_rss / 1024.0 ** (2 if sys.platform == 'darwin' else 1)
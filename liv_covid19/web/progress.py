@@ -0,0 +1,48 @@
+'''
+(c) University of Liverpool 2020
+
+Licensed under the MIT License.
+
+To view a copy of this license, visit <http://opensource.org/licenses/MIT/>..
+
+@author: neilswainston
+'''
+from concurrent.futures import CancelledError
+from contextlib import contextmanager
+import time
+
+
+class Progress():
+    '''Reports the start, and the wall-clock duration, of named job stages.'''
+
+    def __init__(self, report=None, is_cancelled=None):
+        self.__report = report
+        self.__is_cancelled = is_cancelled
+
+    def check(self):
+        '''Cancellation checkpoint: raises CancelledError if the job has been
+        cancelled.'''
+        if self.__is_cancelled and self.__is_cancelled():
+            raise CancelledError()
+
+    @contextmanager
+    def stage(self, name):
+        '''Context manager timing a stage.'''
+        self.check()
+
+        if self.__report:
+            self.__report(name, None)
+
+        start = time.time()
+        yield
+
+        if self.__report:
+            self.__report(name, time.time() - start)
+
+
+def call(func, queue, cancel_event, kwargs):
+    '''Calls func in a worker process, reporting its progress to queue, and
+    checking cancel_event at each checkpoint.'''
+    return func(progress=Progress(lambda *msg: queue.put(msg),
+                                  cancel_event.is_set),
+                **kwargs)
@@ -0,0 +1,203 @@
+'''
+(c) University of Liverpool 2020
+
+Licensed under the MIT License.
+
+To view a copy of this license, visit <http://opensource.org/licenses/MIT/>..
+
+@author: neilswainston
+'''
+# pylint: disable=broad-except
+import asyncio
+import json
+import re
+import resource
+import socket
+import sys
+import tempfile
+from threading import Thread
+import time
+
+from liv_covid19.web.manager import Manager
+
+
+_PATH = re.compile(r'^/progress/([^/?]+)')
+
+_LAST_EVENT_ID = re.compile(br'^Last-Event-ID:[ \t]*(\d+)[ \t]*\r?$',
+                            re.IGNORECASE | re.MULTILINE)
+
+_HEADERS = b'HTTP/1.1 200 OK\r\n' \
+    b'Content-Type: text/event-stream\r\n' \
+    b'Cache-Control: no-cache\r\n' \
+    b'Connection: keep-alive\r\n' \
+    b'Access-Control-Allow-Origin: *\r\n\r\n'
+
+_NOT_FOUND = b'HTTP/1.1 404 Not Found\r\n' \
+    b'Content-Length: 0\r\n' \
+    b'Connection: close\r\n\r\n'
+
+
+class ProgressServer():
+    '''Asyncio side-car serving /progress/<job_id> event streams.'''
+
+    def __init__(self, manager, host='0.0.0.0', port=5001, heartbeat=15):
+        self.__manager = manager
+        self.__host = host
+        self.__port = port
+        self.__heartbeat = heartbeat
+        self.__loop = asyncio.new_event_loop()
+        self.__subscribers = {}
+        self.__num_clients = 0
+
+    def start(self):
+        '''Starts server in a background thread, returning the bound port.'''
+        server = self.__loop.run_until_complete(
+            asyncio.start_server(self.__handle, self.__host, self.__port,
+                                 backlog=4096,
+                                 reuse_port=hasattr(socket, 'SO_REUSEPORT')))
+
+        self.__manager.add_progress_listener(self)
+        Thread(target=self.__loop.run_forever, daemon=True).start()
+        return server.sockets[0].getsockname()[1]
+
+    def get_num_clients(self):
+        '''Gets number of connected clients.'''
+        return self.__num_clients
+
+    def progress_fired(self, job_id, event_id, frame, end):
+        '''Responds to job event being fired (in any thread).'''
+        self.__loop.call_soon_threadsafe(self.__dispatch, job_id, event_id,
+                                         frame, end)
+
+    def __dispatch(self, job_id, event_id, frame, end):
+        '''Passes event, encoded once, to all subscribers of its job.'''
+        message = (event_id, frame.encode(), end)
+
+        for queue in self.__subscribers.get(job_id, []):
+            queue.put_nowait(message)
+
+    async def __handle(self, reader, writer):
+        '''Handles client connection.'''
+        self.__num_clients += 1
+
+        try:
+            request = await reader.readuntil(b'\r\n\r\n')
+            match = _PATH.match(request.split(b' ')[1].decode())
+
+            if not match:
+                writer.write(_NOT_FOUND)
+            else:
+                last_event_id = _LAST_EVENT_ID.search(request)
+                writer.write(_HEADERS)
+                await self.__stream(match.group(1), writer,
+                                    int(last_event_id.group(1))
+                                    if last_event_id else 0)
+
+            await writer.drain()
+        except Exception:
+            # Client disconnected, or sent a malformed request:
+            pass
+        finally:
+            self.__num_clients -= 1
+            writer.close()
+
+    async def __stream(self, job_id, writer, last_event_id):
+        '''Streams job events to client, after last_event_id, until the job
+        ends.'''
+        queue = asyncio.Queue()
+        self.__subscribers.setdefault(job_id, []).append(queue)
+        idx = last_event_id
+
+        # Events of jobs run by other processes are not pushed, so poll:
+        timeout = self.__heartbeat if self.__manager.is_local(job_id) \
+            else min(self.__manager.get_poll_interval(), self.__heartbeat)
+
+        last_write = time.time()
+
+        try:
+            events = await self.__get_frames(job_id, idx)
+
+            while True:
+                for event_id, frame, end in events:
+                    if event_id is not None and event_id <= idx and not end:
+                        # Already sent:
+                        continue
+
+                    writer.write(frame)
+                    last_write = time.time()
+
+                    if end:
+                        return
+
+                    idx = event_id
+
+                await writer.drain()
+
+                try:
+                    events = [await asyncio.wait_for(queue.get(), timeout)]
+                except asyncio.TimeoutError:
+                    if time.time() - last_write >= self.__heartbeat:
+                        writer.write(b': heartbeat\n\n')
+                        last_write = time.time()
+
+                    events = await self.__get_frames(job_id, idx)
+        finally:
+            self.__subscribers[job_id].remove(queue)
+
+            if not self.__subscribers[job_id]:
+                del self.__subscribers[job_id]
+
+    async def __get_frames(self, job_id, after):
+        '''Gets encoded job events from store, without blocking the event
+        loop.'''
+        frames = await self.__loop.run_in_executor(
+            None, self.__manager.get_frames, job_id, after)
+
+        return [(event_id, frame.encode(), end)
+                for event_id, frame, end in frames]
+
+
+def main(args):
+    '''main method: measures connection capacity by holding args[0] streams
+    open on one queued job, and reporting connect time and memory.'''
+    num_clients = int(args[0]) if args else 5000
+
+    # Raise open file limit to its maximum:
+    _, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    # With no workers, the job stays queued and its streams stay open:
+    manager = Manager(tempfile.gettempdir(), max_workers=0, cache_size=0)
+    job_id = manager.submit(json.dumps({'app': 'Normalise',
+                                        'file_name': 'plate.csv',
+                                        'file_content': '1,2\n',
+                                        'target_mass': 50.0,
+                                        'temp_deck': 'tempdeck',
+                                        'vol_scale': 1.0}))
+
+    server = ProgressServer(manager, '127.0.0.1', 0)
+    port = server.start()
+
+    async def _connect():
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(('GET /progress/%s HTTP/1.1\r\n\r\n' %
+                      job_id).encode())
+        await reader.readuntil(b'data:')
+        return writer
+
+    async def _connect_all():
+        return await asyncio.gather(*[_connect() for _ in range(num_clients)])
+
+    start = time.time()
+    writers = asyncio.new_event_loop().run_until_complete(_connect_all())
+
+    print('%i concurrent streams connected in %.2fs, max RSS %.1f MB' %
+          (server.get_num_clients(), time.time() - start,
+           resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0))
+
+    for writer in writers:
+        writer.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,352 @@
+'''
+(c) University of Liverpool 2020
+
+Licensed under the MIT License.
+
+To view a copy of this license, visit <http://opensource.org/licenses/MIT/>..
+
+@author: neilswainston
+'''
+from collections import deque, OrderedDict
+import json
+import sqlite3
+from threading import local, RLock
+import time
+
+from liv_covid19.web.job import END_STATUSES
+
+
+class MemoryJobStore():
+    '''Job store held in the memory of a single server process.'''
+
+    def __init__(self, max_expired=10000, max_events=256):
+        self.__max_expired = max_expired
+        self.__max_events = max_events
+        self.__jobs = {}
+        self.__events = {}
+        self.__ended = OrderedDict()
+        self.__expired = OrderedDict()
+        self.__cancels = set()
+        self.__lock = RLock()
+
+    def add_job(self, job_id):
+        '''Adds job.'''
+        with self.__lock:
+            self.__jobs[job_id] = {'event': None, 'result': None,
+                                   'last_event_id': 0}
+            self.__events[job_id] = deque(maxlen=self.__max_events)
+
+    def remove_job(self, job_id):
+        '''Removes job.'''
+        with self.__lock:
+            self.__jobs.pop(job_id, None)
+            self.__events.pop(job_id, None)
+            self.__ended.pop(job_id, None)
+            self.__cancels.discard(job_id)
+
+    def request_cancel(self, job_id):
+        '''Requests cancellation of job, by whichever process runs it.'''
+        with self.__lock:
+            if job_id in self.__jobs:
+                self.__cancels.add(job_id)
+
+    def is_cancel_requested(self, job_id):
+        '''Checks whether cancellation of job has been requested.'''
+        return job_id in self.__cancels
+
+    def add_event(self, job_id, event):
+        '''Adds event, returning its (per job, increasing) event id and its
+        SSE frame.'''
+        end = event['update']['status'] in END_STATUSES
+
+        with self.__lock:
+            job = self.__jobs[job_id]
+            job['last_event_id'] += 1
+            event_id = job['last_event_id']
+            frame = get_frame(event_id, json.dumps(event))
+            job['event'] = event
+            self.__events[job_id].append((event_id, event, frame, end))
+
+            if end:
+                self.__ended[job_id] = time.time()
+
+            return event_id, frame
+
+    def get_events(self, job_id, after=0):
+        '''Gets (event id, event) of events after event id.'''
+        with self.__lock:
+            return [(event_id, event) for event_id, event, _, _
+                    in self.__events.get(job_id, []) if event_id > after]
+
+    def get_frames(self, job_id, after=0):
+        '''Gets (event id, SSE frame, whether job's end event) of events
+        after event id.'''
+        with self.__lock:
+            return [(event_id, frame, end) for event_id, _, frame, end
+                    in self.__events.get(job_id, []) if event_id > after]
+
+    def get_status(self, job_id):
+        '''Gets (status, latest event, or end status if expired) of job, or
+        (None, None) if unknown.'''
+        with self.__lock:
+            if job_id in self.__expired:
+                return 'expired', self.__expired[job_id]
+
+            job = self.__jobs.get(job_id)
+
+            if not job:
+                return None, None
+
+            if not job['event']:
+                return 'submitted', None
+
+            return job['event']['update']['status'], job['event']
+
+    def touch(self, job_id):
+        '''Refreshes end time of job, delaying its expiry.'''
+        with self.__lock:
+            if job_id in self.__ended:
+                self.__ended[job_id] = time.time()
+                self.__ended.move_to_end(job_id)
+
+    def set_result(self, job_id, location):
+        '''Sets result location.'''
+        with self.__lock:
+            self.__jobs[job_id]['result'] = location
+
+    def get_result(self, job_id):
+        '''Gets result location, or None.'''
+        with self.__lock:
+            job = self.__jobs.get(job_id)
+            return job['result'] if job else None
+
+    def prune(self, expiry, max_jobs):
+        '''Expires ended jobs that ended before expiry, or beyond the maximum
+        number of jobs, returning their ids.'''
+        expired_ids = []
+
+        with self.__lock:
+            while self.__ended:
+                job_id, ended = next(iter(self.__ended.items()))
+
+                if ended >= expiry and len(self.__jobs) <= max_jobs:
+                    break
+
+                del self.__ended[job_id]
+                del self.__events[job_id]
+                self.__cancels.discard(job_id)
+                job = self.__jobs.pop(job_id)
+                self.__expired[job_id] = job['event']['update']['status']
+                expired_ids.append(job_id)
+
+            # Drop oldest expired summaries beyond maximum:
+            while len(self.__expired) > self.__max_expired:
+                self.__expired.popitem(last=False)
+
+        return expired_ids
+
+
+class SQLiteJobStore():
+    '''Job store in a SQLite database, shared by several server processes.'''
+
+    def __init__(self, filename, max_expired=10000, max_events=256):
+        self.__filename = filename
+        self.__max_expired = max_expired
+        self.__max_events = max_events
+        self.__local = local()
+
+        with self.__transaction() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS jobs ('
+                         'job_id TEXT PRIMARY KEY, '
+                         'status TEXT, '
+                         'event TEXT, '
+                         'last_event_id INTEGER NOT NULL DEFAULT 0, '
+                         'ended REAL, '
+                         'expired INTEGER NOT NULL DEFAULT 0, '
+                         'result TEXT)')
+            conn.execute('CREATE TABLE IF NOT EXISTS events ('
+                         'job_id TEXT NOT NULL, '
+                         'event_id INTEGER NOT NULL, '
+                         'event TEXT NOT NULL, '
+                         'PRIMARY KEY (job_id, event_id))')
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_ended '
+                         'ON jobs (expired, ended)')
+            conn.execute('CREATE TABLE IF NOT EXISTS cancels ('
+                         'job_id TEXT PRIMARY KEY)')
+
+    def add_job(self, job_id):
+        '''Adds job.'''
+        with self.__transaction() as conn:
+            conn.execute('INSERT INTO jobs (job_id, status) VALUES (?, ?)',
+                         (job_id, 'submitted'))
+
+    def remove_job(self, job_id):
+        '''Removes job.'''
+        with self.__transaction() as conn:
+            conn.execute('DELETE FROM events WHERE job_id = ?', (job_id,))
+            conn.execute('DELETE FROM cancels WHERE job_id = ?', (job_id,))
+            conn.execute('DELETE FROM jobs WHERE job_id = ?', (job_id,))
+
+    def request_cancel(self, job_id):
+        '''Requests cancellation of job, by whichever process runs it.'''
+        with self.__transaction() as conn:
+            conn.execute('INSERT OR IGNORE INTO cancels '
+                         'SELECT job_id FROM jobs WHERE job_id = ?',
+                         (job_id,))
+
+    def is_cancel_requested(self, job_id):
+        '''Checks whether cancellation of job has been requested.'''
+        return self.__get_conn().execute(
+            'SELECT 1 FROM cancels WHERE job_id = ?',
+            (job_id,)).fetchone() is not None
+
+    def add_event(self, job_id, event):
+        '''Adds event, returning its (per job, increasing) event id and its
+        SSE frame.'''
+        status = event['update']['status']
+        data = json.dumps(event)
+
+        with self.__transaction() as conn:
+            event_id = conn.execute(
+                'SELECT last_event_id FROM jobs WHERE job_id = ?',
+                (job_id,)).fetchone()[0] + 1
+
+            conn.execute('UPDATE jobs SET status = ?, event = ?, '
+                         'last_event_id = ?, ended = ? WHERE job_id = ?',
+                         (status, data, event_id,
+                          time.time() if status in END_STATUSES else None,
+                          job_id))
+            conn.execute('INSERT INTO events VALUES (?, ?, ?)',
+                         (job_id, event_id, data))
+            conn.execute('DELETE FROM events '
+                         'WHERE job_id = ? AND event_id <= ?',
+                         (job_id, event_id - self.__max_events))
+
+        return event_id, get_frame(event_id, data)
+
+    def get_events(self, job_id, after=0):
+        '''Gets (event id, event) of events after event id.'''
+        rows = self.__get_conn().execute(
+            'SELECT event_id, event FROM events '
+            'WHERE job_id = ? AND event_id > ? ORDER BY event_id',
+            (job_id, after)).fetchall()
+
+        return [(event_id, json.loads(event)) for event_id, event in rows]
+
+    def get_frames(self, job_id, after=0):
+        '''Gets (event id, SSE frame, whether job's end event) of events
+        after event id.'''
+        # Events are stored serialised, so are framed without parsing:
+        rows = self.__get_conn().execute(
+            'SELECT events.event_id, events.event, jobs.status, '
+            'jobs.last_event_id FROM events JOIN jobs USING (job_id) '
+            'WHERE job_id = ? AND events.event_id > ? '
+            'ORDER BY events.event_id',
+            (job_id, after)).fetchall()
+
+        return [(event_id, get_frame(event_id, data),
+                 status in END_STATUSES and event_id == last_event_id)
+                for event_id, data, status, last_event_id in rows]
+
+    def get_status(self, job_id):
+        '''Gets (status, latest event, or end status if expired) of job, or
+        (None, None) if unknown.'''
+        row = self.__get_conn().execute(
+            'SELECT status, event, expired FROM jobs WHERE job_id = ?',
+            (job_id,)).fetchone()
+
+        if not row:
+            return None, None
+
+        if row[2]:
+            return 'expired', row[0]
+
+        return row[0], json.loads(row[1]) if row[1] else None
+
+    def touch(self, job_id):
+        '''Refreshes end time of job, delaying its expiry.'''
+        with self.__transaction() as conn:
+            conn.execute('UPDATE jobs SET ended = ? WHERE job_id = ? '
+                         'AND ended IS NOT NULL AND expired = 0',
+                         (time.time(), job_id))
+
+    def set_result(self, job_id, location):
+        '''Sets result location.'''
+        with self.__transaction() as conn:
+            conn.execute('UPDATE jobs SET result = ? WHERE job_id = ?',
+                         (location, job_id))
+
+    def get_result(self, job_id):
+        '''Gets result location, or None.'''
+        row = self.__get_conn().execute(
+            'SELECT result FROM jobs WHERE job_id = ? AND expired = 0',
+            (job_id,)).fetchone()
+
+        return row[0] if row else None
+
+    def prune(self, expiry, max_jobs):
+        '''Expires ended jobs that ended before expiry, or beyond the maximum
+        number of jobs, returning their ids.'''
+        with self.__transaction() as conn:
+            num_live = conn.execute(
+                'SELECT COUNT(*) FROM jobs WHERE expired = 0').fetchone()[0]
+
+            expired_ids = [row[0] for row in conn.execute(
+                'SELECT job_id FROM jobs '
+                'WHERE expired = 0 AND ended IS NOT NULL '
+                'AND (ended < ? OR job_id IN ('
+                'SELECT job_id FROM jobs '
+                'WHERE expired = 0 AND ended IS NOT NULL '
+                'ORDER BY ended LIMIT ?))',
+                (expiry, max(0, num_live - max_jobs)))]
+
+            for job_id in expired_ids:
+                conn.execute('UPDATE jobs SET event = NULL, expired = 1, '
+                             'result = NULL WHERE job_id = ?', (job_id,))
+                conn.execute('DELETE FROM events WHERE job_id = ?',
+                             (job_id,))
+                conn.execute('DELETE FROM cancels WHERE job_id = ?',
+                             (job_id,))
+
+            # Drop oldest expired summaries beyond maximum:
+            conn.execute('DELETE FROM jobs WHERE job_id IN ('
+                         'SELECT job_id FROM jobs WHERE expired = 1 '
+                         'ORDER BY ended DESC LIMIT -1 OFFSET ?)',
+                         (self.__max_expired,))
+
+        return expired_ids
+
+    def __get_conn(self):
+        '''Gets connection of current thread.'''
+        if not hasattr(self.__local, 'conn'):
+            self.__local.conn = sqlite3.connect(self.__filename, timeout=30,
+                                                isolation_level=None)
+            self.__local.conn.execute('PRAGMA journal_mode=WAL')
+
+        return self.__local.conn
+
+    def __transaction(self):
+        '''Gets transaction context of current thread's connection.'''
+        return _Transaction(self.__get_conn())
+
+
+def get_frame(event_id, data):
+    '''Gets SSE frame of serialised event.'''
+    if event_id is None:
+        return 'data:' + data + '\n\n'
+
+    return 'id:%i\ndata:%s\n\n' % (event_id, data)
+
+
+class _Transaction():
+    '''Context manager for an immediate (write-locking) transaction.'''
+
+    def __init__(self, conn):
+        self.__conn = conn
+
+    def __enter__(self):
+        self.__conn.execute('BEGIN IMMEDIATE')
+        return self.__conn
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.__conn.execute('COMMIT' if exc_type is None else 'ROLLBACK')
@@ -10,17 +10,21 @@ To view a copy of this license, visit <http://opensource.org/licenses/MIT/>..
 # pylint: disable=invalid-name
 # pylint: disable=unused-argument
 # pylint: disable=wrong-import-order
+# pylint: disable=wrong-import-position
 # import json
 import json
 import os
 import sys
 import tempfile
+import time
 import traceback
 import uuid
 
-from flask import Flask, jsonify, request, Response, send_file
+from flask import Flask, g, jsonify, request, Response, send_file
+from werkzeug.exceptions import HTTPException
 
-from liv_covid19.web import manager
+from liv_covid19.web import manager, store
+from liv_covid19.web.executor import QueueFullError
 
 
 # Configuration:
@@ -32,14 +36,95 @@ _STATIC_FOLDER = os.path.join(os.path.dirname(os.path.realpath(__file__)),
 
 _EXPORT_FOLDER = tempfile.gettempdir()
 
+# Cache lifetime, in seconds, of (immutable) results:
+_RESULT_MAX_AGE = 365 * 24 * 60 * 60
+
 app = Flask(__name__, static_folder=_STATIC_FOLDER)
 app.config.from_object(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 1024 * 1024 * 1024
+app.config['MAX_WORKERS'] = int(os.environ.get('MAX_WORKERS', 2))
+app.config['MAX_QUEUE'] = int(os.environ.get('MAX_QUEUE', 32))
+app.config['USE_PROCESSES'] = os.environ.get('USE_PROCESSES') == '1'
+app.config['JOB_TTL'] = int(os.environ.get('JOB_TTL', 3600))
+app.config['MAX_JOBS'] = int(os.environ.get('MAX_JOBS', 1000))
+app.config['RESULT_MODE'] = os.environ.get('RESULT_MODE', 'disk')
+app.config['COMPRESS_LEVEL'] = int(os.environ.get('COMPRESS_LEVEL', 6))
+app.config['CACHE_SIZE'] = int(os.environ.get('CACHE_SIZE', 256))
+app.config['JOB_STORE'] = os.environ.get('JOB_STORE')
+app.config['PROGRESS_PORT'] = os.environ.get('PROGRESS_PORT')
+app.config['HEARTBEAT'] = int(os.environ.get('HEARTBEAT', 15))
+app.config['MAX_EVENTS'] = int(os.environ.get('MAX_EVENTS', 256))
+app.config['SYNC_MAX_BYTES'] = int(os.environ.get('SYNC_MAX_BYTES', 32768))
+app.config['SIMULATORS'] = int(os.environ.get('SIMULATORS', 0))
+app.config['SIM_CACHE'] = os.environ.get(
+    'SIM_CACHE', os.path.join(tempfile.gettempdir(), 'simulations.db'))
+app.config['SIM_CACHE_BYTES'] = int(os.environ.get('SIM_CACHE_BYTES',
+                                                   256 * 1024 ** 2))
 
 DEBUG = False
 TESTING = False
 
-_MANAGER = manager.Manager(_EXPORT_FOLDER)
+# Share job state between server processes if a job store is configured
+# (results must then be on disk, to be served by any process):
+if app.config['JOB_STORE'] and app.config['RESULT_MODE'] == 'memory':
+    raise ValueError('RESULT_MODE=memory cannot be used with JOB_STORE, as '
+                     'only the process running a job would hold its result')
+
+_JOB_STORE = store.SQLiteJobStore(app.config['JOB_STORE'],
+                                  max_events=app.config['MAX_EVENTS']) \
+    if app.config['JOB_STORE'] else None
+
+_MANAGER = manager.Manager(_EXPORT_FOLDER,
+                           max_workers=app.config['MAX_WORKERS'],
+                           max_queue=app.config['MAX_QUEUE'],
+                           use_processes=app.config['USE_PROCESSES'],
+                           job_ttl=app.config['JOB_TTL'],
+                           max_jobs=app.config['MAX_JOBS'],
+                           result_mode=app.config['RESULT_MODE'],
+                           compresslevel=app.config['COMPRESS_LEVEL'],
+                           cache_size=app.config['CACHE_SIZE'],
+                           job_store=_JOB_STORE,
+                           max_events=app.config['MAX_EVENTS'],
+                           sync_max_bytes=app.config['SYNC_MAX_BYTES'],
+                           simulators=app.config['SIMULATORS'],
+                           sim_cache=app.config['SIM_CACHE'],
+                           sim_cache_bytes=app.config['SIM_CACHE_BYTES'])
+
+# Optionally serve progress streams from an asyncio side-car, for proxies to
+# route /progress/ to, rather than holding a WSGI thread per stream (one per
+# server process, sharing the port):
+if app.config['PROGRESS_PORT']:
+    from liv_covid19.web import sse
+    sse.ProgressServer(_MANAGER, port=int(app.config['PROGRESS_PORT']),
+                       heartbeat=app.config['HEARTBEAT']).start()
+
+
+@app.before_request
+def start_timer():
+    '''Records start time of request.'''
+    g.start_time = time.time()
+
+
+@app.after_request
+def record_latency(response):
+    '''Records latency of request, by route.'''
+    if 'start_time' in g:
+        _MANAGER.get_metrics().observe(
+            'http_request_duration_seconds',
+            time.time() - g.start_time,
+            {'route': request.url_rule.rule if request.url_rule else 'none',
+             'method': request.method,
+             'status': response.status_code})
+
+    return response
+
+
+@app.route('/_ah/warmup')
+def warmup():
+    '''Responds to App Engine warmup request, loading job modules (and the
+    numeric stack) before the instance serves traffic.'''
+    _MANAGER.warmup()
+    return ''
 
 
 @app.route('/')
@@ -57,14 +142,61 @@ def get_path(path):
 @app.route('/submit', methods=['POST'])
 def submit():
     '''Responds to submission.'''
-    return json.dumps({'job_id': _MANAGER.submit(request.data)})
+    wait = request.args.get('wait', 0, type=float)
+    job_id = _MANAGER.submit(request.data, wait)
+
+    if not wait:
+        return json.dumps({'job_id': job_id})
+
+    status = _MANAGER.get_status(job_id)
+
+    if status == 'finished':
+        response = get_result(job_id)
+        response.headers['X-Job-Id'] = job_id
+        return response
+
+    if status in ['error', 'cancelled']:
+        _, event = _MANAGER.get_events(job_id)[-1]
+        response = jsonify({'job_id': job_id, 'status': status,
+                            'message': event['update']['message']})
+        response.status_code = 422
+        return response
+
+    response = jsonify({'job_id': job_id, 'status': status})
+    response.status_code = 202
+    return response
+
+
+@app.route('/submit/upload', methods=['POST'])
+def submit_upload():
+    '''Responds to multipart submission, streaming the uploaded file.'''
+    fle = request.files['file']
+    query = _get_form_query()
+    query.setdefault('file_name', fle.filename)
+
+    return json.dumps({'job_id': _MANAGER.submit_file(query, fle.stream)})
+
+
+@app.route('/submit/batch', methods=['POST'])
+def submit_batch():
+    '''Responds to multipart submission of a batch of files, one per
+    plate.'''
+    files = [(fle.filename, fle.stream)
+             for fle in request.files.getlist('files')]
+
+    return json.dumps({'job_id': _MANAGER.submit_batch(_get_form_query(),
+                                                       files)})
 
 
 @app.route('/progress/<job_id>')
 def progress(job_id):
-    '''Returns progress of job.'''
-    return Response(_MANAGER.get_progress(job_id),
-                    mimetype='text/event-stream')
+    '''Returns progress of job, resuming after the Last-Event-ID of a
+    reconnecting client.'''
+    last_event_id = request.headers.get('Last-Event-ID', '')
+
+    return Response(_MANAGER.get_progress(
+        job_id, int(last_event_id) if last_event_id.isdigit() else 0),
+        mimetype='text/event-stream')
 
 
 @app.route('/cancel/<job_id>')
@@ -73,13 +205,101 @@ def cancel(job_id):
     return _MANAGER.cancel(job_id)
 
 
+@app.route('/cache')
+def get_cache_stats():
+    '''Get result cache statistics.'''
+    return jsonify(_MANAGER.get_cache_stats())
+
+
+@app.route('/metrics')
+def get_metrics():
+    '''Get metrics, in the Prometheus text format.'''
+    return Response(_MANAGER.get_metrics().render(),
+                    mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/profile/<job_id>')
+def get_profile(job_id):
+    '''Get profile summary of job submitted with a true 'profile' flag.'''
+    summary = _MANAGER.get_profile(job_id)
+
+    if summary is None:
+        response = jsonify({'message': 'No profile of job: ' + job_id})
+        response.status_code = 404
+        return response
+
+    return Response(summary, mimetype='text/plain')
+
+
 @app.route('/result/<job_id>')
 def get_result(job_id):
     '''Get result.'''
-    return send_file(os.path.join(_EXPORT_FOLDER, job_id + '.zip'),
-                     attachment_filename=job_id + '.zip',
-                     mimetype='application/octet-stream',
-                     as_attachment=True)
+    status = _MANAGER.get_status(job_id)
+
+    if status != 'finished':
+        if status == 'expired':
+            message = 'Job expired: ' + job_id
+        elif status:
+            message = 'No result of job: ' + job_id
+        else:
+            message = 'Unknown job: ' + job_id
+
+        response = jsonify({'message': message})
+        response.status_code = 410 if status == 'expired' else 404
+        return response
+
+    etag = _MANAGER.get_result_etag(job_id)
+    bundle = _MANAGER.get_bundle(job_id)
+
+    if bundle:
+        # Zip in-memory result on the fly, or in full to serve a range:
+        data = b''.join(bundle.stream(app.config['COMPRESS_LEVEL'])) \
+            if request.range else \
+            bundle.stream(app.config['COMPRESS_LEVEL'])
+
+        response = Response(data,
+                            mimetype='application/octet-stream',
+                            headers={'Content-Disposition':
+                                     'attachment; filename=%s.zip' % job_id})
+
+        if etag:
+            response.set_etag(etag)
+
+        response.make_conditional(
+            request, accept_ranges=True,
+            complete_length=len(data) if request.range else None)
+    else:
+        response = send_file(_MANAGER.get_result_filename(job_id) or
+                             os.path.join(_EXPORT_FOLDER, job_id + '.zip'),
+                             attachment_filename=job_id + '.zip',
+                             mimetype='application/octet-stream',
+                             as_attachment=True,
+                             conditional=True,
+                             etag=etag or True)
+
+    response.accept_ranges = 'bytes'
+
+    if etag:
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = _RESULT_MAX_AGE
+        response.cache_control.immutable = True
+
+    return response
+
+
+@app.errorhandler(QueueFullError)
+def handle_queue_full(error):
+    '''Handles submissions rejected by a full job queue.'''
+    response = jsonify({'message': str(error)})
+    response.status_code = 503
+    return response
+
+
+@app.errorhandler(HTTPException)
+def handle_http_error(error):
+    '''Handles HTTP errors, such as unsatisfiable ranges, as themselves.'''
+    return error
 
 
 @app.errorhandler(Exception)
@@ -92,6 +312,15 @@ def handle_error(_):
     return response
 
 
+def _get_form_query():
+    '''Gets query parameters of multipart submission, from a JSON 'query'
+    field if present, otherwise from the remaining form fields.'''
+    if 'query' in request.form:
+        return json.loads(request.form['query'])
+
+    return request.form.to_dict()
+
+
 def main(argv):
     '''main method.'''
     if argv:
@@ -42,7 +42,7 @@ livCovApp.service("LivCovService", ["$http", "$rootScope", "ErrorService", "Prog
 			jobResponse = JSON.parse(event.data);
 			status = jobResponse.update.status;
 			
-			if(status == "cancelled" || status == "error" || status == "finished") {
+			if(status == "cancelled" || status == "error" || status == "finished" || status == "expired") {
 				source.close();
 				jobId = null;
 			}
@@ -51,9 +51,12 @@ livCovApp.service("LivCovService", ["$http", "$rootScope", "ErrorService", "Prog
 		};
 		
 		source.onerror = function(event) {
-			source.close();
-			jobId = null;
-			onerror(event.message);
+			// While reconnecting, the browser resumes the stream from the
+			// Last-Event-ID it has seen, so only give up once it has closed:
+			if(source.readyState == EventSource.CLOSED) {
+				jobId = null;
+				onerror(event.message);
+			}
 		}
 	};
 	